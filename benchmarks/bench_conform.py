@@ -0,0 +1,91 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark gather based msa.kdenlive.conform_track_edit against the original per clip loop
+on synthetic tracks with lots of short clips and blanks.
+For large clip counts the frame size is scaled down (see --max_mb) so the outputs fit in memory,
+i.e. those rows mostly measure the per clip overhead.
+
+e.g.
+    python benchmarks/bench_conform.py --clips 10 100 1000 10000 100000 1000000
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import numpy as np
+
+from common import timeit
+import msa.kdenlive
+import msa.mxml
+
+
+def make_track_dict(num_clips, src_len, max_clip_len=5, blank_prob=0.2, seed=0):
+    '''create a random track_dict (as it would be after update_track_properties and update_track_info)'''
+    rng = np.random.RandomState(seed)
+    children = []
+    for _ in range(num_clips):
+        l = rng.randint(1, max_clip_len+1)
+        if rng.rand() < blank_prob:
+            children.append({'TAG':'blank', 'length':l})
+        else:
+            i = rng.randint(0, src_len - l)
+            children.append({'TAG':'entry', 'producer':'1_video', 'in':i, 'out':i+l-1})
+    track_dict = {'TAG':'playlist', 'id':'playlist0', 'CHILDREN':children}
+    msa.kdenlive.update_track_info(track_dict)
+    return track_dict
+
+
+def conform_track_edit_loop(track_dict, source, special_keys=msa.mxml.default_special_keys, empty_value=0):
+    '''original implementation of conform_track_edit (one slice copy per child), for reference'''
+    K = msa.kdenlive
+    target = np.zeros((track_dict[K.KEY_LENGTH], ) + source.shape[1:], dtype=source.dtype)
+    if empty_value: target.fill(empty_value)
+    for c in track_dict[special_keys[K.KEY_CHILDREN]]:
+        if all([x in c for x in [K.KEY_OUT, K.KEY_IN, K.KEY_LENGTH, K.KEY_START]]):
+            i,s,l = c[K.KEY_IN], c[K.KEY_START], c[K.KEY_LENGTH]
+            src = source[c[K.KEY_PRODUCER]] if type(source)==dict else source
+            target[s:s+l] = src[i:i+l]
+    return target
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', default=[10, 100, 1000, 10000, 100000, 1000000], type=int, nargs='+', help='list of clip counts to test')
+    parser.add_argument('--src_len', default=10000, type=int, help='number of frames in synthetic source')
+    parser.add_argument('--dim', default=512, type=int, help='dimensions of each frame (e.g. z size)')
+    parser.add_argument('--max_mb', default=256, type=int, help='maximum size of each conformed array, frames are made smaller than --dim if needed (0 for no limit)')
+    parser.add_argument('--repeats', default=3, type=int, help='number of repeats (best time is reported)')
+    args = parser.parse_args()
+
+    full_src = np.random.randn(args.src_len, args.dim).astype(np.float32)
+    print('{:>10} {:>10} {:>6} {:>12} {:>12} {:>12} {:>9}'.format('clips', 'frames', 'dim', 'loop (s)', 'gather (s)', 'Track (s)', 'speedup'))
+    for n in args.clips:
+        track_dict = make_track_dict(n, args.src_len)
+        track = msa.kdenlive.Track.from_dict(track_dict)
+        dim = min(args.dim, max(1, args.max_mb * 1000000 // (max(track.length, 1) * full_src.itemsize))) if args.max_mb else args.dim
+        src = np.ascontiguousarray(full_src[:, :dim])
+
+        ref = conform_track_edit_loop(track_dict, src)
+        assert np.array_equal(ref, msa.kdenlive.conform_track_edit(track_dict, src)), 'gather and loop results differ'
+        del ref
+
+        t_loop = timeit(lambda: conform_track_edit_loop(track_dict, src), args.repeats)
+        t_gather = timeit(lambda: msa.kdenlive.conform_track_edit(track_dict, src), args.repeats)
+        t_track = timeit(lambda: msa.kdenlive.conform_track_edit(track, src), args.repeats)
+        print('{:>10} {:>10} {:>6} {:>12.5f} {:>12.5f} {:>12.5f} {:>8.1f}x'.format(n, track.length, dim, t_loop, t_gather, t_track, t_loop / t_track))
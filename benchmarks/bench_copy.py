@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark copy throughput (GB/s) of msa.kdenlive.conform_track_edit by number of copy threads (see msa.data.parallel_take),
+conforming the test project onto the frames of the test video, upscaled to big frames (HD by default, 4K with --size 2160 3840 which needs ~8GB of RAM).
+Both the gather into a fresh array (as conform_track_edit does) and into a preallocated one (as EditView with out does) are timed.
+
+e.g.
+    python benchmarks/bench_copy.py --size 2160 3840 --threads 1 2 4 8
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+import numpy as np
+
+from common import ROOT_DIR, timeit
+import msa.kdenlive
+import msa.data
+
+
+def load_frames(path, size):
+    '''decode video at path and upscale frames (nearest neighbour) to size (height, width)'''
+    with msa.kdenlive.VideoReader(path) as reader: frames = reader[:]
+    h, w = frames.shape[1:3]
+    rows = np.arange(size[0]) * h // size[0]
+    cols = np.arange(size[1]) * w // size[1]
+    return np.ascontiguousarray(frames[:, rows][:, :, cols])
+
+
+if __name__ == '__main__':
+    root = os.path.join(ROOT_DIR, 'testdata')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kdenlive_prj_path', default=os.path.join(root, 'test.kdenlive'), help='path to kdenlive project')
+    parser.add_argument('--track_name', default='Video 1', help='name of track to conform')
+    parser.add_argument('--video_path', default=os.path.join(root, 'video_orig.mp4'), help='path to source video')
+    parser.add_argument('--size', default=[1080, 1920], type=int, nargs=2, help='height and width to upscale frames to')
+    parser.add_argument('--threads', default=[1, 2, 4, 8], type=int, nargs='+', help='list of thread counts to test')
+    parser.add_argument('--repeats', default=3, type=int, help='number of repeats (best time is reported)')
+    args = parser.parse_args()
+
+    prj = msa.kdenlive.Project(args.kdenlive_prj_path)
+    track = prj.timeline.find_by_name(args.track_name)[0]
+    src = load_frames(args.video_path, args.size)
+    producers, frames = track.frame_map()
+    idx = np.where(frames < 0, 0, frames)
+    out = np.empty((len(idx), ) + src.shape[1:], dtype=src.dtype)
+    gb = out.nbytes / 1e9
+    print('Conforming {} frames of {} ({:.2f} GB) from {} source frames'.format(track.length, 'x'.join(map(str, src.shape[1:])), gb, len(src)))
+
+    ref = msa.kdenlive.conform_track_edit(track, src)
+    print('{:>8} {:>14} {:>10} {:>14} {:>10}'.format('threads', 'conform (s)', 'GB/s', 'into out (s)', 'GB/s'))
+    for n in args.threads:
+        assert np.array_equal(ref, msa.kdenlive.conform_track_edit(track, src, copy_threads=n)), 'results differ with {} threads'.format(n)
+        t_conform = timeit(lambda: msa.kdenlive.conform_track_edit(track, src, copy_threads=n), args.repeats)
+        t_out = timeit(lambda: msa.data.parallel_take(src, idx, out=out, num_threads=n), args.repeats)
+        print('{:>8} {:>14.4f} {:>10.2f} {:>14.4f} {:>10.2f}'.format(n, t_conform, gb / t_conform, t_out, gb / t_out))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark msa.mxml.e_to_dict against the original recursive version, and with include_tags (only properties, entries and blanks)
+skipping the filters, on synthetic kdenlive style documents.
+
+e.g.
+    python benchmarks/bench_e_to_dict.py --producers 100 1000 10000
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from lxml import etree
+
+from common import timeit
+import msa.mxml
+import msa.utils
+
+
+def make_project_xml(num_producers, num_properties=20, entries_per_producer=4, filters_per_entry=1):
+    '''create a kdenlive style mlt document with num_producers producers, and a playlist using each of them a few times (with filters)'''
+    root = etree.Element('mlt', root='/tmp')
+    for i in range(num_producers):
+        p = etree.SubElement(root, 'producer', id='producer{}'.format(i), out='999')
+        for j in range(num_properties):
+            etree.SubElement(p, 'property', name='prop{}'.format(j)).text = 'value {} {}'.format(i, j)
+    playlist = etree.SubElement(root, 'playlist', id='playlist0')
+    etree.SubElement(playlist, 'property', name='kdenlive:track_name').text = 'Video 1'
+    for i in range(num_producers):
+        for j in range(entries_per_producer):
+            etree.SubElement(playlist, 'blank', length='5')
+            e = etree.SubElement(playlist, 'entry', producer='producer{}'.format(i), **{'in':str(j*10), 'out':str(j*10+9)})
+            for k in range(filters_per_entry):
+                f = etree.SubElement(e, 'filter', id='filter{}_{}_{}'.format(i, j, k))
+                for name in ['mlt_service', 'kdenlive_id', 'level', 'gain']:
+                    etree.SubElement(f, 'property', name=name).text = '1'
+    return root
+
+
+def e_to_dict_recursive(xml_element, add_empty=False, special_keys=msa.mxml.default_special_keys):
+    '''original (recursive) implementation of e_to_dict, for reference'''
+    tag_key, children_key, value_key = special_keys['tag'], special_keys['children'], special_keys['value']
+    if type(xml_element) != etree._Element: return xml_element
+    assert(msa.utils.find_key(xml_element.attrib, special_keys.values()) is None) # make sure keys aren't in attrib
+    d = { tag_key:xml_element.tag }
+    if add_empty or len(xml_element) > 0: d[children_key] = [e_to_dict_recursive(c) for c in xml_element]
+    if add_empty or xml_element.text: d[value_key] = xml_element.text
+    d.update(**xml_element.attrib)
+    return d
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--producers', default=[100, 1000, 10000], type=int, nargs='+', help='list of producer counts to test')
+    parser.add_argument('--properties', default=20, type=int, help='number of properties per producer')
+    parser.add_argument('--repeats', default=3, type=int, help='number of repeats (best time is reported)')
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>14} {:>14} {:>14} {:>9} {:>9}'.format('producers', 'elements', 'recursive (s)', 'iterative (s)', 'tags (s)', 'speedup', 'tags'))
+    for n in args.producers:
+        root = make_project_xml(n, args.properties)
+        num_elements = sum(1 for _ in root.iter())
+        assert e_to_dict_recursive(root) == msa.mxml.e_to_dict(root), 'recursive and iterative results differ'
+
+        t_rec = timeit(lambda: e_to_dict_recursive(root), args.repeats)
+        t_it = timeit(lambda: msa.mxml.e_to_dict(root), args.repeats)
+        t_tags = timeit(lambda: msa.mxml.e_to_dict(root, include_tags=['producer', 'playlist', 'property', 'entry', 'blank']), args.repeats)
+        print('{:>10} {:>10} {:>14.4f} {:>14.4f} {:>14.4f} {:>8.1f}x {:>8.1f}x'.format(n, num_elements, t_rec, t_it, t_tags, t_rec / t_it, t_rec / t_tags))
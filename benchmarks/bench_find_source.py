@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Check Track.find_source_frames against a brute force search of Track.frame_map, on random tracks with
+speed changes, reverse and freeze frames (and a few very long clips), then time both.
+Exits with an error if any result differs.
+
+e.g.
+    python benchmarks/bench_find_source.py --clips 1000 10000 100000 --queries 1000
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+import common # puts the repo root on sys.path
+import msa.kdenlive
+
+SPEEDS = [1., 1., 1., 0.5, 2., -1., 0., 1.5, -0.7, 0.3]
+
+
+def make_track(num_clips, num_producers=4, src_len=10000, max_clip_len=50, seed=0):
+    '''return Track with num_clips random rows (blanks, entries at normal and warped speeds, and a few clips as long as the source)'''
+    rng = np.random.RandomState(seed)
+    producers = rng.randint(-1, num_producers, size=num_clips)
+    lengths = rng.randint(1, max_clip_len + 1, size=num_clips)
+    lengths[rng.rand(num_clips) < 0.001] = src_len // 2 # long clips, which made the old search scan every row
+    speeds = np.array(SPEEDS)[rng.randint(0, len(SPEEDS), size=num_clips)]
+    phases = np.where(speeds == 1, 0, rng.rand(num_clips))
+    ins = rng.randint(0, src_len, size=num_clips)
+    ins = np.where(speeds < 0, np.maximum(ins, np.ceil(-speeds * lengths).astype(int) + 1), np.minimum(ins, src_len - np.ceil(speeds * lengths).astype(int) - 1))
+    outs = ins + np.floor(phases + (lengths - 1) * speeds + msa.kdenlive.kdenlive.WARP_EPSILON).astype(int)
+    ins, outs = np.where(producers < 0, -1, ins), np.where(producers < 0, -1, outs)
+    return msa.kdenlive.Track(producers, ins, outs, lengths, ['clip{}'.format(i) for i in range(num_producers)], speeds=speeds, phases=phases)
+
+
+def brute_force(track, producer_name, frames):
+    '''find_source_frames by searching every frame of the timeline'''
+    producers, source_frames = track.frame_map()
+    used = producers == track.producer_names.index(producer_name)
+    queries, timeline_frames = [], []
+    for q, f in enumerate(frames.tolist()):
+        t = np.flatnonzero(used & (source_frames == f))
+        queries.append(np.full(len(t), q, dtype=np.intp))
+        timeline_frames.append(t)
+    return np.concatenate(queries), np.concatenate(timeline_frames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', default=[1000, 10000, 100000], type=int, nargs='+', help='number of rows in each track to test')
+    parser.add_argument('--queries', default=1000, type=int, help='number of source frames to look up per producer')
+    parser.add_argument('--src_len', default=10000, type=int, help='number of frames in sources')
+    parser.add_argument('--seed', default=0, type=int, help='random seed')
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>12} {:>16} {:>16}'.format('clips', 'frames', 'occurrences', 'indexed (ms)', 'brute force (ms)'))
+    for num_clips in args.clips:
+        track = make_track(num_clips, src_len=args.src_len, seed=args.seed)
+        frames = np.random.RandomState(args.seed).randint(0, args.src_len, size=args.queries)
+        track.find_source_frames(track.producer_names[0], frames[:1]) # build the index
+        t_index = t_brute = 0.
+        found = 0
+        for name in track.producer_names:
+            t = time.time()
+            result = track.find_source_frames(name, frames)
+            t_index += time.time() - t
+            t = time.time()
+            expected = brute_force(track, name, frames)
+            t_brute += time.time() - t
+            for a, b in zip(result, expected):
+                if not np.array_equal(a, b): sys.exit('find_source_frames differs from brute force for {} clips, producer {}'.format(num_clips, name))
+            found += len(result[0])
+        print('{:>10} {:>12} {:>12} {:>16.2f} {:>16.2f}'.format(num_clips, track.length, found, t_index * 1000, t_brute * 1000))
+    print('OK: find_source_frames matches brute force')
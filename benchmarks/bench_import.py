@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark startup time: wall time of fresh interpreters importing the msa packages (best of repeats),
+compared to the dependencies they can't do without (numpy and lxml). Fails (exit code 1) if msa.kdenlive
+takes more than budget_ms on top of those, or if any of the deferred modules (only needed for progress bars,
+process pools etc.) get imported.
+On python 3.7+ also prints the slowest modules from python -X importtime.
+
+e.g.
+    python benchmarks/bench_import.py --repeats 20 --budget_ms 10
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import argparse
+import subprocess
+
+from common import ROOT_DIR, timeit
+
+# modules which shouldn't be imported just by importing msa.kdenlive
+DEFERRED_MODULES = ['tqdm', 'future', 'past', 'multiprocessing', 'csv', 'socket', 'json', 'skvideo']
+
+STATEMENTS = [
+    ('python', 'pass'),
+    ('numpy + lxml', 'import numpy, lxml.etree'),
+    ('msa.logger', 'import msa.logger'),
+    ('msa.mxml', 'import msa.mxml'),
+    ('msa.data', 'import msa.data'),
+    ('msa.kdenlive', 'import msa.kdenlive'),
+]
+
+
+def python(args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT_DIR, os.environ.get('PYTHONPATH', '')]))
+    env.pop('PYTHONDONTWRITEBYTECODE', None) # time loading compiled modules, as in normal use
+    return subprocess.Popen([sys.executable] + args, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs).communicate()
+
+
+def time_statement(statement, repeats):
+    '''return best wall time (seconds) of a fresh interpreter running statement'''
+    return timeit(lambda: python(['-c', statement]), repeats)
+
+
+def importtime(statement, top=15):
+    '''return [(cumulative us, module)] of the slowest top modules from python -X importtime (python 3.7+ only)'''
+    _, err = python(['-X', 'importtime', '-c', statement])
+    rows = []
+    for line in err.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        _, cumulative, module = [x.strip() for x in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative), module))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', default=20, type=int, help='number of interpreters to start for each statement (best time is reported)')
+    parser.add_argument('--budget_ms', default=10, type=float, help='maximum time msa.kdenlive may take on top of numpy and lxml')
+    args = parser.parse_args()
+
+    python(['-c', 'import msa.kdenlive']) # compile everything first
+    times = {}
+    print('{:<16} {:>10} {:>14}'.format('import', 'time (ms)', 'on top (ms)'))
+    for name, statement in STATEMENTS:
+        times[name] = time_statement(statement, args.repeats) * 1000
+        print('{:<16} {:>10.1f} {:>14.1f}'.format(name, times[name], times[name] - times['python']))
+
+    overhead = times['msa.kdenlive'] - times['numpy + lxml']
+    out, _ = python(['-c', 'import sys, msa.kdenlive; print(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))'])
+    deferred = sorted(set(out.decode('utf-8').split()) & set(DEFERRED_MODULES))
+
+    if sys.version_info >= (3, 7):
+        print('\nslowest modules (python -X importtime, cumulative):')
+        for us, module in importtime('import msa.kdenlive'): print('{:>10.1f} ms  {}'.format(us / 1000, module))
+
+    print('\nmsa.kdenlive takes {:.1f}ms on top of numpy and lxml (budget {:.1f}ms)'.format(overhead, args.budget_ms))
+    if deferred: print('deferred modules imported at startup:', deferred)
+    sys.exit(1 if overhead > args.budget_ms or deferred else 0)
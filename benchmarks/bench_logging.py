@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark the per call cost of debug logging in a hot loop (e.g. once per clip) when the level is INFO:
+eagerly formatted logger.debug, msa.logger.HotLogger.debug (lazy), and HotLogger with the level check hoisted out of the loop.
+
+e.g.
+    python benchmarks/bench_logging.py --calls 100000 1000000
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import argparse
+
+from common import timeit
+import msa.logger
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', default=[100000, 1000000], type=int, nargs='+', help='list of loop lengths to test')
+    parser.add_argument('--repeats', default=3, type=int, help='number of repeats (best time is reported)')
+    args = parser.parse_args()
+
+    logger = msa.logger.getLogger('bench_logging')
+    hot_logger = msa.logger.getHotLogger('bench_logging')
+    logger.setLevel(logging.INFO)
+
+    def loop_none(n):
+        for i in range(n): pass
+
+    def loop_eager(n):
+        for i in range(n): logger.debug('Applying edit {} {} {}'.format(i, n, i + n))
+
+    def loop_lazy(n):
+        for i in range(n): hot_logger.debug('Applying edit {} {} {}', i, n, i + n)
+
+    def loop_hoisted(n):
+        debug = hot_logger.is_enabled(logging.DEBUG)
+        for i in range(n):
+            if debug: hot_logger.debug('Applying edit {} {} {}', i, n, i + n)
+
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}   (ns per call over empty loop)'.format('calls', 'empty (s)', 'eager', 'lazy', 'hoisted'))
+    for n in args.calls:
+        t = [timeit(lambda: fn(n), args.repeats) for fn in [loop_none, loop_eager, loop_lazy, loop_hoisted]]
+        print('{:>10} {:>12.4f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(n, t[0], *[(x - t[0]) / n * 1e9 for x in t[1:]]))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Benchmark suite: generates synthetic projects and sources of a few sizes (see synthetic.py) and times
+parsing (Project), update_track_info, conform_track_edit and run.py end to end (as a subprocess, npy and optionally video).
+Results are saved as json (with the git commit, python and numpy versions) so runs can be compared across versions.
+
+e.g.
+    python benchmarks/bench_suite.py --cases small medium large --output_path bench_results.json
+    python benchmarks/bench_suite.py --cases custom --producers 1000 --tracks 8 --clips 100000
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import copy
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+from collections import OrderedDict
+import numpy as np
+from lxml import etree
+
+from common import ROOT_DIR, timeit
+import msa.kdenlive
+import msa.data
+import msa.mxml
+import synthetic
+
+# project parameters for each case (see synthetic.make_project_xml)
+CASES = OrderedDict([
+    ('small', dict(num_producers=10, num_tracks=2, clips_per_track=100)),
+    ('medium', dict(num_producers=100, num_tracks=4, clips_per_track=10000)),
+    ('large', dict(num_producers=1000, num_tracks=8, clips_per_track=100000)),
+])
+
+
+def time_update_track_info(track_dicts):
+    '''return time to run update_track_info on fresh copies of track_dicts as parsed (in, out and length still strings), so the int conversions happen every time'''
+    track_dicts = copy.deepcopy(track_dicts)
+    t = time.time()
+    for d in track_dicts: msa.kdenlive.update_track_info(d)
+    return time.time() - t
+
+
+def run_script(args):
+    '''run run.py with args in a subprocess, raising if it fails'''
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'run.py')] + args, stdout=devnull, cwd=ROOT_DIR)
+
+
+def git_commit():
+    try: return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR).decode('utf-8').strip()
+    except Exception: return None
+
+
+def bench_case(name, params, work_dir, repeats=3, dim=512, src_len=1000, video=False):
+    '''generate project and sources for one case in work_dir, return OrderedDict of its parameters, sizes and times (seconds)'''
+    prj_path = synthetic.save_project(os.path.join(work_dir, name + '.kdenlive'), synthetic.make_project_xml(src_len=src_len, **params))
+    src_path = os.path.join(work_dir, name + '_src.npy')
+    src = synthetic.make_npy_source(src_path, src_len, dim)
+
+    prj = msa.kdenlive.Project(prj_path)
+    track = prj.timeline.find_by_name('Video 1')[0]
+    root = etree.parse(prj_path).getroot()
+    track_dicts = [d for k,d in msa.mxml.children_by_key(root, 'playlist', add_empty=False).items() if k.startswith('playlist')] # before update_track_info
+    result = OrderedDict([('name', name), ('params', params), ('src_len', src_len), ('dim', dim), ('xml_bytes', os.path.getsize(prj_path)),
+                          ('frames', track.length), ('clips', len(track)), ('times', OrderedDict())])
+    times = result['times']
+
+    times['project'] = timeit(lambda: msa.kdenlive.Project(prj_path), repeats)
+    times['project_streaming'] = timeit(lambda: msa.kdenlive.Project(prj_path, streaming=True), repeats)
+
+    times['update_track_info'] = min(time_update_track_info(track_dicts) for _ in range(repeats))
+
+    assert np.array_equal(msa.kdenlive.conform_track_edit(track, src), msa.kdenlive.conform_track_edit(prj.tracks[track.id], src)), 'Track and track_dict results differ'
+    times['conform_track_edit'] = timeit(lambda: msa.kdenlive.conform_track_edit(track, src), repeats)
+    times['conform_track_edit_dict'] = timeit(lambda: msa.kdenlive.conform_track_edit(prj.tracks[track.id], src), repeats)
+
+    out_path = os.path.join(work_dir, name + '_out.npy')
+    times['run_npy'] = timeit(lambda: run_script(['-k', prj_path, '-i', src_path, '-o', out_path]), repeats)
+    times['run_npy_mmap'] = timeit(lambda: run_script(['-k', prj_path, '-i', src_path, '-o', out_path, '-m', '1']), repeats)
+    if video:
+        video_path = os.path.join(work_dir, name + '_src.mp4')
+        synthetic.make_video_source(video_path, src_len)
+        times['run_video_stream'] = timeit(lambda: run_script(['-k', prj_path, '-i', video_path, '-o', os.path.join(work_dir, name + '_out.mp4'), '-s', '1']), repeats)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', default=['small', 'medium'], nargs='+', help='cases to run, from {} or custom (see --producers etc)'.format(list(CASES.keys())))
+    parser.add_argument('--producers', default=100, type=int, help='number of producers in custom case')
+    parser.add_argument('--tracks', default=4, type=int, help='number of tracks in custom case')
+    parser.add_argument('--clips', default=1000, type=int, help='number of clips per track in custom case')
+    parser.add_argument('--blank_prob', default=0.2, type=float, help='probability of each clip being a blank in custom case')
+    parser.add_argument('--noise', default=20, type=int, help='number of extra meta properties per producer in custom case')
+    parser.add_argument('--src_len', default=1000, type=int, help='number of frames in sources')
+    parser.add_argument('--dim', default=512, type=int, help='size of each frame of npy source')
+    parser.add_argument('--video', default=0, type=int, help='if 1, also time run.py streaming a video source (needs ffmpeg)')
+    parser.add_argument('--repeats', default=3, type=int, help='number of repeats (best time is reported)')
+    parser.add_argument('--work_dir', default='', help='folder to write projects and sources to (default a temp folder, deleted afterwards)')
+    parser.add_argument('--output_path', default='bench_results.json', help='path to save json results to')
+    args = parser.parse_args()
+
+    cases = OrderedDict(CASES)
+    cases['custom'] = dict(num_producers=args.producers, num_tracks=args.tracks, clips_per_track=args.clips, blank_prob=args.blank_prob, noise=args.noise)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='msa_kdenlive_bench_')
+
+    report = OrderedDict()
+    report['meta'] = OrderedDict([('commit', git_commit()), ('date', datetime.datetime.now().isoformat()), ('python', platform.python_version()),
+                                  ('numpy', np.__version__), ('platform', platform.platform()), ('repeats', args.repeats)])
+    report['results'] = []
+    try:
+        for name in args.cases:
+            print('Running', name, cases[name])
+            r = bench_case(name, cases[name], work_dir, repeats=args.repeats, dim=args.dim, src_len=args.src_len, video=args.video)
+            report['results'].append(r)
+            print('    {} bytes of xml, {} clips, {} frames on Video 1'.format(r['xml_bytes'], r['clips'], r['frames']))
+            for k, v in r['times'].items(): print('    {:<26} {:>10.4f}s'.format(k, v))
+    finally:
+        if not args.work_dir: shutil.rmtree(work_dir)
+
+    msa.data.save_json(report, args.output_path, sort_keys=False)
+    print('Saved results to', args.output_path)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Helpers shared by the benchmarks. Importing this puts the repo root on sys.path, so msa can be imported without installing it.
+
+e.g.
+    from common import ROOT_DIR, timeit # before importing msa
+    import msa.kdenlive
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if ROOT_DIR not in sys.path: sys.path.insert(0, ROOT_DIR)
+
+
+def timeit(fn, repeats):
+    '''return best wall time of fn over repeats'''
+    times = []
+    for _ in range(repeats):
+        t = time.time()
+        fn()
+        times.append(time.time() - t)
+    return min(times)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Generate synthetic Kdenlive (MLT xml) projects of any size, and sources to conform them onto, for benchmarking.
+Projects are laid out like ones saved by Kdenlive: producers (with meta properties), a black track,
+one playlist per track (entries with filters, and blanks) and a main tractor stacking them.
+
+e.g.
+    python benchmarks/synthetic.py --output_dir /tmp/synth --producers 100 --tracks 4 --clips 10000 --video 1
+    python run.py -k /tmp/synth/synth.kdenlive -i /tmp/synth/src.npy -o /tmp/synth/out.npy
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+import numpy as np
+from lxml import etree
+
+import common # puts the repo root on sys.path
+import msa.fileio
+
+
+def make_project_xml(num_producers=10, num_tracks=2, clips_per_track=100, blank_prob=0.2, noise=20, filter_prob=0.1,
+                     src_len=1000, max_clip_len=10, ext='.mp4', seed=0):
+    '''
+    return root element of a synthetic kdenlive project
+    num_producers : number of producers (clips in the bin), all src_len frames long
+    num_tracks : number of video tracks (playlists named 'Video 1', 'Video 2' etc.)
+    clips_per_track : number of clips (entries or blanks) on each track
+    blank_prob : probability of each clip being a blank
+    noise : number of extra (unused) meta properties on each producer, like the ones kdenlive saves
+    filter_prob : probability of each entry having a filter (with a few properties)
+    src_len : number of frames in each producer's media
+    max_clip_len : maximum length of clips and blanks (lengths are uniform in 1 to max_clip_len)
+    ext : extension of producer resources
+    '''
+    rng = np.random.RandomState(seed)
+    root = etree.Element('mlt', title='synthetic', version='6.5.0', root='.', producer='main bin', LC_NUMERIC='C')
+    etree.SubElement(root, 'profile', width='384', height='288', frame_rate_num='25', frame_rate_den='1', progressive='1')
+
+    def add_properties(parent, props):
+        for k, v in props:
+            etree.SubElement(parent, 'property', name=k).text = str(v)
+
+    producer_ids = ['{}_video'.format(i + 1) for i in range(num_producers)]
+    for i, pid in enumerate(producer_ids):
+        p = etree.SubElement(root, 'producer', id=pid, out=str(src_len - 1), **{'in':'0'})
+        add_properties(p, [('length', src_len), ('eof', 'pause'), ('resource', 'clip{:06d}{}'.format(i + 1, ext)), ('mlt_service', 'avformat-novalidate')])
+        add_properties(p, [('meta.media.{}.noise'.format(j), rng.randint(1<<30)) for j in range(noise)])
+
+    black = etree.SubElement(root, 'producer', id='black', **{'in':'0'}) # out and length are set to the timeline length below
+    black_track = etree.SubElement(root, 'playlist', id='black_track')
+
+    track_ids = []
+    max_length = 0
+    for t in range(num_tracks):
+        track_ids.append('playlist{}'.format(t))
+        playlist = etree.SubElement(root, 'playlist', id=track_ids[-1])
+        add_properties(playlist, [('kdenlive:track_name', 'Video {}'.format(t + 1)), ('kdenlive:locked_track', 0)])
+        lengths = rng.randint(1, max_clip_len + 1, size=clips_per_track)
+        blanks = rng.rand(clips_per_track) < blank_prob
+        producers = rng.randint(0, num_producers, size=clips_per_track)
+        ins = (rng.rand(clips_per_track) * (src_len - lengths + 1)).astype(int)
+        for l, is_blank, pi, i in zip(lengths.tolist(), blanks.tolist(), producers.tolist(), ins.tolist()):
+            if is_blank:
+                etree.SubElement(playlist, 'blank', length=str(l))
+                continue
+            e = etree.SubElement(playlist, 'entry', producer=producer_ids[pi], out=str(i + l - 1), **{'in':str(i)})
+            if rng.rand() < filter_prob:
+                f = etree.SubElement(e, 'filter', id='filter{}'.format(rng.randint(1<<30)))
+                add_properties(f, [('mlt_service', 'brightness'), ('kdenlive_id', 'brightness'), ('level', rng.rand())])
+        max_length = max(max_length, int(lengths.sum()))
+    black.set('out', str(max(max_length - 1, 0)))
+    add_properties(black, [('length', max(max_length, 1)), ('mlt_service', 'color'), ('resource', 'black')])
+    etree.SubElement(black_track, 'entry', producer='black', out=str(max(max_length - 1, 0)), **{'in':'0'})
+
+    tractor = etree.SubElement(root, 'tractor', id='maintractor', global_feed='1', out=str(max(max_length - 1, 0)), **{'in':'0'})
+    for k in ['black_track'] + track_ids:
+        etree.SubElement(tractor, 'track', producer=k)
+    for t in range(num_tracks):
+        tr = etree.SubElement(tractor, 'transition', id='transition{}'.format(t))
+        add_properties(tr, [('a_track', 0), ('b_track', t + 1), ('mlt_service', 'qtblend'), ('always_active', 1)])
+    return root
+
+
+def save_project(path, root):
+    '''save project root element to path'''
+    path = msa.fileio.expand(path)
+    msa.fileio.create_dir_for_file(path)
+    etree.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True, pretty_print=True)
+    return path
+
+
+def make_npy_source(path, src_len=1000, dim=512, seed=0):
+    '''save random float32 (src_len, dim) array (e.g. a z-sequence) to path, returns the array'''
+    x = np.random.RandomState(seed).randn(src_len, dim).astype(np.float32)
+    path = msa.fileio.expand(path)
+    msa.fileio.create_dir_for_file(path)
+    np.save(path, x)
+    return x
+
+
+def make_video_source(path, src_len=1000, size=(288, 384), fps=25):
+    '''save src_len frame video to path, each frame a gradient with its frame number stamped into the corner (needs ffmpeg)'''
+    import msa.kdenlive # only needed for video
+    h, w = size
+    base = (np.add.outer(np.arange(h) * 255 // max(h - 1, 1), np.arange(w) * 255 // max(w - 1, 1)) // 2).astype(np.uint8)
+    with msa.kdenlive.VideoWriter(path, fps=fps) as writer:
+        for i in range(src_len):
+            frame = np.repeat(base[..., None], 3, axis=2)
+            frame[:32, :32] = (i * 37) % 256, (i * 73) % 256, (i * 151) % 256
+            writer.write(frame[None])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_dir', required=True, help='folder to write project (synth.kdenlive) and sources (src.npy, src.mp4) to')
+    parser.add_argument('--producers', default=10, type=int, help='number of producers')
+    parser.add_argument('--tracks', default=2, type=int, help='number of tracks')
+    parser.add_argument('--clips', default=100, type=int, help='number of clips (entries and blanks) per track')
+    parser.add_argument('--blank_prob', default=0.2, type=float, help='probability of each clip being a blank')
+    parser.add_argument('--noise', default=20, type=int, help='number of extra meta properties per producer')
+    parser.add_argument('--filter_prob', default=0.1, type=float, help='probability of each entry having a filter')
+    parser.add_argument('--src_len', default=1000, type=int, help='number of frames in sources')
+    parser.add_argument('--max_clip_len', default=10, type=int, help='maximum length of each clip or blank')
+    parser.add_argument('--dim', default=512, type=int, help='size of each frame of npy source')
+    parser.add_argument('--video', default=0, type=int, help='if 1, also write a video source')
+    parser.add_argument('--seed', default=0, type=int, help='random seed')
+    args = parser.parse_args()
+
+    root = make_project_xml(args.producers, args.tracks, args.clips, blank_prob=args.blank_prob, noise=args.noise, filter_prob=args.filter_prob,
+                            src_len=args.src_len, max_clip_len=args.max_clip_len, seed=args.seed)
+    print('Saved', save_project(os.path.join(args.output_dir, 'synth.kdenlive'), root))
+    make_npy_source(os.path.join(args.output_dir, 'src.npy'), args.src_len, args.dim, seed=args.seed)
+    print('Saved', os.path.join(args.output_dir, 'src.npy'))
+    if args.video:
+        make_video_source(os.path.join(args.output_dir, 'src.mp4'), args.src_len)
+        print('Saved', os.path.join(args.output_dir, 'src.mp4'))
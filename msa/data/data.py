@@ -18,14 +18,11 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
 import numpy as np
 import os
-import json
-import codecs
-import random
-from tqdm import tqdm
 
 import msa.fileio
 
@@ -205,6 +202,7 @@ def merge_dicts_by_name(P, D, id_key='name', root='', depth=0, indent='   '):
 
 def save_json(o, path, indent=4, sort_keys=True, ensure_ascii=False):
     '''save object as json, only works with serialiseable objects'''
+    import json
     
     def default(obj):
         '''https://stackoverflow.com/questions/15876180/convert-numpy-arrays-in-a-nested-dictionary-into-list-whilst-preserving-dictiona?rq=1'''
@@ -223,6 +221,7 @@ def save_json(o, path, indent=4, sort_keys=True, ensure_ascii=False):
 
 def load_json(path):
     '''load object from json'''
+    import json
     if not path.endswith('.json'): path = path + '.json'
     path = msa.fileio.expand(path)
     logger.debug(path)
@@ -249,6 +248,7 @@ def load_json(path):
 
 def load_txt_files(folder, limit_chars=-1, ext='.txt', encoding='utf-8'):
     """load text files in folder, return dict {key: filename, value: text}"""
+    import codecs
     logger.info(folder)
     # get src text filenames
     in_filenames = os.listdir(folder)
@@ -298,14 +298,90 @@ def create_seqs(texts, seq_len, seq_step):
 
 def rand_seq(text, seq_len, start_max=-1):
     start_max = len(text) if start_max < 0 else start_max
+    import random
     start_index = random.randint(0, start_max - seq_len - 1)
     s = text[start_index: start_index + seq_len]
     return s
 
 
 
+class NpyWriter(object):
+    '''write frames to an npy file in batches, preallocated with np.lib.format.open_memmap (shape must be known up front)'''
+    def __init__(self, path, shape, dtype):
+        self.path = msa.fileio.expand(path)
+        msa.fileio.create_dir_for_file(self.path)
+        self.memmap = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=tuple(shape))
+        self.pos = 0
+
+    def write(self, frames):
+        with msa.logger.span('write.npy') as span:
+            self.memmap[self.pos:self.pos+len(frames)] = frames
+            span.add_bytes(frames.nbytes)
+        self.pos += len(frames)
+
+    def close(self):
+        self.memmap.flush()
+        return self.memmap
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_npy_in_batches(path, X, batch_size, show_progress=False, progress_desc=''):
+    '''save indexable X (ndarray, memmap, or anything with shape, dtype and slicing e.g. msa.kdenlive.EditView) as npy.
+    written batch_size frames at a time with NpyWriter, so X never needs to fit in memory. returns the (flushed) memmap
+    '''
+    with NpyWriter(path, X.shape, X.dtype) as writer:
+        for x in iterate_in_batches(X, batch_size, show_progress=show_progress, progress_desc=progress_desc): writer.write(x)
+    return writer.memmap
+
+
 def iterate_in_batches(X, batch_size, show_progress=False, progress_desc=''):
 #    g = (itertools.islice(X, i, i+size) for i in xrange(0, len(X), size))
     g = (X[i:i+batch_size] for i in range(0, len(X), batch_size))
-    if show_progress: g = tqdm(g, desc=progress_desc, total=len(X)//batch_size)
-    return g
\ No newline at end of file
+    if show_progress:
+        from tqdm import tqdm # pip install tqdm
+        g = tqdm(g, desc=progress_desc, total=len(X)//batch_size)
+    return g
+
+
+
+# thread pools for parallel_take, one per size, kept alive between calls
+_thread_pools = {}
+
+def _thread_pool(num_threads):
+    if num_threads not in _thread_pools:
+        from multiprocessing.pool import ThreadPool
+        _thread_pools[num_threads] = ThreadPool(num_threads)
+    return _thread_pools[num_threads]
+
+
+def _split(n, item_bytes, num_threads, min_bytes):
+    '''return boundaries splitting n items into (up to) num_threads ranges of at least min_bytes, or None if it's not worth splitting'''
+    if num_threads is None:
+        import multiprocessing
+        num_threads = multiprocessing.cpu_count()
+    num_threads = min(num_threads, n, n * item_bytes // max(min_bytes, 1))
+    if num_threads <= 1: return None
+    return np.linspace(0, n, num_threads + 1).astype(int).tolist()
+
+
+def parallel_take(src, idx, out=None, num_threads=None, min_bytes=1<<22):
+    '''np.take(src, idx, axis=0, out=out) with idx split into ranges across num_threads threads (None for cpu count)
+    numpy releases the GIL while copying, so big gathers (e.g. 4K frames) can use the memory bandwidth of several cores
+    gathers are only split into ranges of at least min_bytes (smaller ones aren't worth the overhead)
+    idx must be in range (it's not checked)
+    '''
+    idx = np.asarray(idx)
+    if out is None: out = np.empty((len(idx), ) + tuple(src.shape[1:]), dtype=src.dtype)
+    bounds = _split(len(idx), out[:1].nbytes, num_threads, min_bytes)
+    if bounds is None: return np.take(src, idx, axis=0, out=out, mode='clip')
+    if src.flags.c_contiguous:
+        def take(i): np.take(src, idx[bounds[i]:bounds[i+1]], axis=0, out=out[bounds[i]:bounds[i+1]], mode='clip')
+    else: # np.take would make a contiguous copy of the whole of src in every thread
+        def take(i): out[bounds[i]:bounds[i+1]] = src[idx[bounds[i]:bounds[i+1]]]
+    _thread_pool(len(bounds) - 1).map(take, range(len(bounds) - 1))
+    return out
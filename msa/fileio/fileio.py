@@ -18,7 +18,8 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
 import os
 
@@ -1 +1,7 @@
-from kdenlive import *
\ No newline at end of file
+from kdenlive import *
+from transitions import *
+from conform import *
+from media import *
+from batch import *
+from cache import *
+from verify import *
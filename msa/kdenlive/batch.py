@@ -0,0 +1,281 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Conform many tracks in parallel across a process pool.
+Workers are only sent Tracks (a few small numpy arrays) and paths, and open sources themselves
+(npy memmapped, so all workers share the same pages via the OS page cache, videos with VideoReader).
+
+Usage:
+    prj = msa.kdenlive.Project(path)
+    results = msa.kdenlive.conform_tracks(prj, 'z_orig.npy', 'out_{name}.npy') # all tracks
+    msa.kdenlive.print_summary(results)
+
+    # or many projects at once, from a manifest of jobs (see load_manifest)
+    results = msa.kdenlive.conform_manifest(msa.kdenlive.load_manifest('jobs.json'), retries=1)
+    msa.kdenlive.save_report(results, 'report.json')
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import os
+import time
+import traceback
+from collections import OrderedDict
+
+import msa.fileio
+import msa.data
+from msa.kdenlive.kdenlive import Project, Timeline
+from msa.kdenlive.conform import EditView
+from msa.kdenlive.media import SourceRegistry, VideoReader, native_str, open_source, write_in_batches
+from msa.kdenlive.cache import load_project
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+
+
+def conform_tracks(tracks, input_path, output_path, track_names=None, num_workers=None, chunk_size=64, empty_value=0, source_ext=None):
+    '''
+    conform many tracks in parallel, writing each to its own file. returns list of result dicts (see conform_track_job)
+    tracks : Project, Timeline or ordered dict of tracks
+    input_path : path to npy or video source, or folder of sources (one per producer, see SourceRegistry)
+    output_path : template for output paths, formatted with the track's name, id and index e.g. 'out/{index:02d}_{name}.npy'
+        (if there are no fields in it, the track name is appended to the filename)
+    track_names : list of track names to conform (None for all)
+    num_workers : size of process pool (None for cpu count, 0 or 1 to run in this process)
+    '''
+    timeline = _get_timeline(tracks)
+    paths = None
+    if os.path.isdir(msa.fileio.expand(input_path)):
+        prj = tracks if hasattr(tracks, 'producers') else None
+        if prj is None: raise ValueError('input_path is a folder, so a Project is needed to find the producers')
+        paths = dict(SourceRegistry(prj.producers, root_dir=input_path, search_dirs=[prj.root_dir], ext=source_ext).paths)
+
+    jobs = []
+    for index, track in enumerate(timeline):
+        if track_names is not None and track.name not in track_names: continue
+        jobs.append(dict(track=track, input_path=input_path, paths=paths, output_path=format_output_path(output_path, track, index),
+                         chunk_size=chunk_size, empty_value=empty_value))
+
+    return run_jobs(conform_track_job, jobs, num_workers=num_workers)
+
+
+def conform_track_job(job):
+    '''
+    worker: conform job['track'] onto source at job['input_path'] (or job['paths'] {producer : path}), write to job['output_path']
+    returns dict with name, output_path, frames, time (seconds), error (traceback string, or None) and skipped (True if track is empty)
+    '''
+    track = job['track']
+    result = dict(name=track.name, id=track.id, output_path=job['output_path'], frames=track.length, time=0, error=None, skipped=track.length==0)
+    if result['skipped']: return result
+    t = time.time()
+    try:
+        src = SourceRegistry({}, paths=job['paths']) if job['paths'] else open_source(job['input_path'])
+        if isinstance(src, VideoReader): src.plan([(i, o) for _, i, o in track.source_ranges()])
+        write_in_batches(job['output_path'], EditView(track, src, empty_value=job['empty_value']), job['chunk_size'], fps=getattr(src, 'fps', 25))
+        if hasattr(src, 'close'): src.close()
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['time'] = time.time() - t
+    return result
+
+
+def load_manifest(path):
+    '''
+    load list of jobs from a json (list of dicts) or csv (with header row) file. Each job has:
+        project : path to kdenlive project
+        track : name of track to conform (default 'Video 1')
+        input : path to npy or video source, or folder of sources (one per producer, see SourceRegistry)
+        output : path to write conformed npy or video to
+        source_ext : [OPTIONAL] see SourceRegistry
+    '''
+    path = msa.fileio.expand(path)
+    if path.endswith('.csv'):
+        import csv
+        with open(path, 'r') as f: jobs = [dict(row) for row in csv.DictReader(f)]
+    else:
+        import json
+        with open(path, 'r') as f: jobs = json.load(f)
+    for i, job in enumerate(jobs):
+        for k in ['project', 'input', 'output']:
+            if not job.get(k): raise ValueError("Job {} in {} has no '{}'".format(i, path, k))
+        job.setdefault('track', 'Video 1')
+    return jobs
+
+
+def conform_manifest(jobs, num_workers=None, retries=1, chunk_size=64, empty_value=0, cache_dir=None):
+    '''
+    conform many (project, track, input, output) jobs (see load_manifest) across a process pool.
+    jobs sharing an input and project are sent to one worker as a group and run back to back, and each worker keeps
+    recently used projects and sources open (see _cached), so each is only parsed / opened once.
+    failed jobs are retried up to retries times, then skipped.
+    if cache_dir is given, parsed projects are also cached on disk there (see load_project)
+    returns list of results (same order as jobs) with per stage timings (see conform_manifest_job)
+    '''
+    groups = OrderedDict()
+    for i, job in enumerate(jobs): groups.setdefault((job['input'], job['project']), []).append(i)
+    jobs = [dict(job, retries=retries, chunk_size=chunk_size, empty_value=empty_value, cache_dir=cache_dir) for job in jobs]
+    return run_jobs(conform_manifest_job, jobs, num_workers=num_workers, groups=list(groups.values()))
+
+
+def conform_manifest_job(job):
+    '''
+    worker: run a single manifest job (with retries)
+    returns dict with name, project, track, input, output_path, frames, attempts, error (traceback string of last attempt, or None),
+    time (total seconds) and times (seconds per stage: project, source, conform)
+    '''
+    result = dict(name=u'{}:{}'.format(os.path.basename(job['project']), job['track']), project=job['project'], track=job['track'], input=job['input'],
+                  output_path=job['output'], frames=0, attempts=0, error=None, skipped=False, time=0, times=OrderedDict())
+    t_start = time.time()
+    for attempt in range(job.get('retries', 0) + 1):
+        result['attempts'] = attempt + 1
+        result['error'] = None
+        times = result['times'] = OrderedDict()
+        try:
+            t = time.time()
+            prj = _cached(('project', job['project']), lambda: load_project(job['project'], cache_dir=job['cache_dir']) if job.get('cache_dir') else Project(job['project']))
+            track = prj.timeline.find_by_name(job['track'])
+            if not track: raise KeyError('Track "{}" not found in {}'.format(job['track'], job['project']))
+            track = track[0]
+            result['frames'] = track.length
+            times['project'] = time.time() - t
+
+            t = time.time()
+            if os.path.isdir(msa.fileio.expand(job['input'])):
+                key = ('registry', job['input'], job['project'], job.get('source_ext'))
+                src = _cached(key, lambda: SourceRegistry(prj.producers, root_dir=job['input'], search_dirs=[prj.root_dir], ext=job.get('source_ext') or None))
+            else:
+                src = _cached(('source', job['input']), lambda: open_source(job['input']))
+                if isinstance(src, VideoReader): src.plan([(i, o) for _, i, o in track.source_ranges()])
+            times['source'] = time.time() - t
+
+            t = time.time()
+            write_in_batches(job['output'], EditView(track, src, empty_value=job.get('empty_value', 0)), job.get('chunk_size', 64), fps=getattr(src, 'fps', 25))
+            times['conform'] = time.time() - t
+            break
+
+        except Exception:
+            result['error'] = traceback.format_exc()
+            logger.warning('Job {} attempt {} failed: {}'.format(native_str(result['name']), attempt + 1, result['error'].strip().split('\n')[-1]))
+            _clear_cache() # in case a bad handle caused it
+
+    result['time'] = time.time() - t_start
+    return result
+
+
+def save_report(results, path):
+    '''save per job results and timings as json'''
+    msa.data.save_json(results, path, sort_keys=False)
+
+
+def run_jobs(fn, jobs, num_workers=None, groups=None):
+    '''run fn on each job in a process pool (or in this process if num_workers is 0 or 1), logging progress as jobs finish
+    groups : list of lists of indices into jobs, each group is sent to one worker as a single task and run in order
+        (e.g. jobs sharing a source, so it's only opened once). None for one job per task
+    returns list of results in the same order as jobs
+    '''
+    import multiprocessing
+    if groups is None: groups = [[i] for i in range(len(jobs))]
+    tasks = [[(i, jobs[i]) for i in group] for group in groups]
+    if num_workers is None: num_workers = multiprocessing.cpu_count()
+    num_workers = min(num_workers, len(tasks))
+    logger.info('Running {} jobs in {} groups on {} workers'.format(len(jobs), len(tasks), max(num_workers, 1)))
+    results = [None] * len(jobs)
+    if num_workers <= 1:
+        it = (_IndexedFn(fn)(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        it = pool.imap_unordered(_IndexedFn(fn), tasks)
+
+    t = time.time()
+    n = 0
+    for task_results in it:
+        for i, r in task_results:
+            results[i] = r
+            n += 1
+            logger.info('[{}/{}] {} {} frames in {:.2f}s {}'.format(n, len(jobs), native_str(r.get('name')), r.get('frames'), r.get('time', 0), 'FAILED' if r.get('error') else 'skipped' if r.get('skipped') else ''))
+
+    if num_workers > 1:
+        pool.close()
+        pool.join()
+    else:
+        _clear_cache()
+    logger.info('Finished {} jobs in {:.2f}s'.format(len(jobs), time.time() - t))
+    return results
+
+
+class _IndexedFn(object):
+    '''picklable wrapper running fn on a task (list of (index, job)), so imap_unordered results can be put back in order'''
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, task):
+        return [(i, self.fn(job)) for i, job in task]
+
+
+def print_summary(results):
+    '''print table of results returned by conform_tracks'''
+    print('{:<24} {:>10} {:>10} {:>12}  {}'.format('track', 'frames', 'time (s)', 'frames/s', 'output'))
+    for r in results:
+        fps = r['frames'] / r['time'] if r['time'] else 0
+        name = native_str(u'{:<24}'.format(u'{}'.format(r['name'])[:24])) # pad and truncate before encoding, so characters aren't cut in half
+        print('{} {:>10} {:>10.2f} {:>12.1f}  {}'.format(name, r['frames'], r['time'], fps, 'skipped (empty track)' if r['skipped'] else r['output_path']))
+        if r['error']: print('    ERROR:', r['error'].strip().split('\n')[-1])
+    num_done = sum(1 for r in results if not r['error'] and not r['skipped'])
+    total_frames, total_time = sum(r['frames'] for r in results if not r['error']), sum(r['time'] for r in results)
+    print('{} tracks: {} done, {} skipped, {} failed. {} frames, {:.2f}s total job time'.format(len(results), num_done, sum(1 for r in results if r['skipped']), sum(1 for r in results if r['error']), total_frames, total_time))
+
+
+# per process cache of recently used projects and sources, so jobs sharing them don't reload them
+_cache = OrderedDict()
+_cache_size = 8
+
+def _cached(key, fn):
+    '''return cached fn() for key (calling fn if it's not in the cache), closing least recently used items if cache is full'''
+    if key in _cache:
+        v = _cache.pop(key)
+    else:
+        v = fn()
+        while len(_cache) >= _cache_size: _close(_cache.pop(next(iter(_cache))))
+    _cache[key] = v
+    return v
+
+
+def _clear_cache():
+    while _cache: _close(_cache.popitem()[1])
+
+
+def _close(o):
+    if hasattr(o, 'close'): o.close()
+
+
+def format_output_path(output_path, track, index):
+    '''format output_path template with track name, id and index (appending name if there are no fields in it). returns a native str'''
+    output_path = native_str(output_path)
+    if '{' not in output_path:
+        root, ext = os.path.splitext(output_path)
+        output_path = root + '_{name}' + ext
+    name = native_str(track.name).replace(os.sep, '_').replace(' ', '_')
+    return output_path.format(name=name, id=native_str(track.id), index=index)
+
+
+def _get_timeline(tracks):
+    if isinstance(tracks, Timeline): return tracks
+    if hasattr(tracks, 'timeline'): return tracks.timeline
+    return Timeline.from_dicts(tracks)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+On disk cache of parsed Projects (producers, playlists, tracks and timeline, pickled), so repeat loads skip
+parsing the xml. Entries are keyed by the content hash of the .kdenlive file (and the Project arguments).
+Content hashes are remembered per (path, size, mtime) so unchanged files don't even need to be re-read.
+The cache is bounded to max_bytes, least recently used entries are evicted first.
+Several processes (e.g. run_batch.py workers) can share a cache_dir: every file is written atomically,
+each remembered hash is its own small file, and entries another process already evicted are skipped.
+
+Usage:
+    prj = msa.kdenlive.load_project(path) # same as msa.kdenlive.Project(path), but cached
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import os
+import gc
+import hashlib
+try: import cPickle as pickle # python 2
+except ImportError: import pickle # python 3
+
+import msa.fileio
+from msa.kdenlive.kdenlive import KEY_ROOT, Project
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get('MSA_KDENLIVE_CACHE', '~/.cache/msa_kdenlive')
+MAX_HASHES = 10000 # number of remembered content hashes to keep
+CACHE_VERSION = 4 # increase if Project changes, to invalidate old entries
+
+
+def load_project(xml_path, cache_dir=None, max_bytes=1<<30, **kwargs):
+    '''
+    return Project(xml_path, **kwargs), loaded from the on disk cache if this file has been parsed before (with the same kwargs)
+    otherwise parsed and added to the cache. Cached projects have tree and root set to None (as if loaded with streaming=True)
+    cache_dir : folder to store cache in (default DEFAULT_CACHE_DIR, or $MSA_KDENLIVE_CACHE)
+    max_bytes : maximum size of the cache, least recently used entries are evicted when it's exceeded
+    '''
+    xml_path = msa.fileio.expand(xml_path)
+    cache_dir = msa.fileio.expand(cache_dir or DEFAULT_CACHE_DIR)
+    msa.fileio.create_dir(cache_dir)
+    entry_path = os.path.join(cache_dir, project_key(xml_path, cache_dir, **kwargs) + '.pkl')
+
+    if os.path.exists(entry_path):
+        try:
+            gc.disable() # unpickling millions of small dicts triggers lots of pointless gc passes
+            try:
+                with open(entry_path, 'rb') as f: prj = pickle.load(f)
+            finally:
+                gc.enable()
+            os.utime(entry_path, None) # mark as recently used
+            # identical files elsewhere share the entry, so anything derived from the path comes from whichever was cached first
+            prj.path = xml_path
+            prj.root_dir = prj.attrib.get(KEY_ROOT, os.path.dirname(xml_path))
+            logger.debug('Loaded {} from cache {}'.format(xml_path, entry_path))
+            return prj
+        except Exception as e:
+            logger.warning('Could not load cache entry {}: {}'.format(entry_path, e))
+
+    prj = Project(xml_path, **kwargs)
+    prj.tree = prj.root = None # same as it would be when loaded from cache
+    _atomic_write(entry_path, lambda f: pickle.dump(prj, f, protocol=pickle.HIGHEST_PROTOCOL))
+    evict_project_cache(cache_dir, max_bytes)
+    return prj
+
+
+def project_key(xml_path, cache_dir, **kwargs):
+    '''cache key for Project(xml_path, **kwargs): content hash of file + hash of kwargs'''
+    import json
+    args = json.dumps([CACHE_VERSION] + sorted((k, sorted(v) if type(v) in (list, tuple, set) else v) for k,v in kwargs.items()))
+    return '{}-{}'.format(content_hash(xml_path, cache_dir), hashlib.sha1(args.encode('utf-8')).hexdigest()[:12])
+
+
+def content_hash(path, cache_dir):
+    '''
+    sha1 of file contents. Remembered for each (path, size, mtime) so unchanged files aren't re-read,
+    one file per key in cache_dir/hashes (so processes sharing the cache never overwrite each other's)
+    '''
+    st = os.stat(path)
+    quick_key = '{}:{}:{}'.format(os.path.abspath(path), st.st_size, st.st_mtime)
+    hash_dir = os.path.join(cache_dir, 'hashes')
+    hash_path = os.path.join(hash_dir, hashlib.sha1(quick_key.encode('utf-8')).hexdigest())
+    try:
+        with open(hash_path, 'rb') as f: digest = f.read().decode('utf-8')
+        if len(digest) == 40: return digest
+    except (IOError, OSError):
+        pass
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''): h.update(block)
+    msa.fileio.create_dir(hash_dir)
+    _atomic_write(hash_path, lambda f: f.write(h.hexdigest().encode('utf-8')))
+    return h.hexdigest()
+
+
+def evict_project_cache(cache_dir, max_bytes, max_hashes=MAX_HASHES):
+    '''
+    delete least recently used entries in cache_dir until it's under max_bytes (and oldest remembered hashes over max_hashes)
+    safe to run while other processes use (or evict from) the same cache: files which disappear are taken as already evicted
+    '''
+    cache_dir = msa.fileio.expand(cache_dir)
+    entries = _stat_files(cache_dir, '.pkl')
+    total = sum(e[1] for e in entries)
+    for _, size, p in entries:
+        if total <= max_bytes: break
+        logger.debug('Evicting {} from cache'.format(p))
+        _remove(p)
+        total -= size
+
+    hashes = _stat_files(os.path.join(cache_dir, 'hashes'))
+    for _, _, p in hashes[:max(len(hashes) - max_hashes, 0)]: _remove(p)
+
+
+def _stat_files(folder, ext=''):
+    '''return sorted list of (mtime, size, path) of files in folder ending with ext, skipping any which disappear meanwhile'''
+    try: names = os.listdir(folder)
+    except OSError: return []
+    files = []
+    for fn in names:
+        if not fn.endswith(ext) or fn.endswith('.tmp'): continue
+        p = os.path.join(folder, fn)
+        try:
+            st = os.stat(p)
+            files.append((st.st_mtime, st.st_size, p))
+        except OSError: # evicted by another process
+            pass
+    return sorted(files)
+
+
+def _remove(path):
+    try: os.remove(path)
+    except OSError: # already evicted by another process
+        pass
+
+
+def clear_project_cache(cache_dir=None):
+    '''delete all entries in cache'''
+    evict_project_cache(cache_dir or DEFAULT_CACHE_DIR, 0, max_hashes=0)
+
+
+def _atomic_write(path, fn):
+    '''call fn(f) with a temp file then move it to path, so other processes never see a half written file'''
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f: fn(f)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
@@ -0,0 +1,307 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Conform edits without materializing the whole edited array.
+
+Usage:
+    prj = msa.kdenlive.Project(path)
+    track = msa.kdenlive.find_tracks_by_name(prj.timeline, 'Video 1')[0]
+    view = msa.kdenlive.EditView(track, np.load(src_path, mmap_mode='r'))
+
+    for batch in msa.data.iterate_in_batches(view, 32):
+        render(batch)
+
+    # or as a generator of chunks
+    for batch in msa.kdenlive.conform_chunks(track, src, 32):
+        render(batch)
+
+    # re-conform after editing the project, only rewriting frames which have changed since last time
+    msa.kdenlive.conform_track_incremental(track, src, 'out.npy', source_id=msa.kdenlive.file_id(src_path))
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import os
+import numpy as np
+
+import msa.mxml
+import msa.data
+import msa.fileio
+from msa.kdenlive.kdenlive import Track, gather_frames, first_source, _expand_ranges
+from msa.kdenlive.transitions import apply_transitions
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+
+
+class EditView(object):
+    '''
+    lazy read-only view of a track edit applied to source(s)
+    behaves like the array returned by conform_track_edit, but frames are only gathered from the source when asked for
+    (so with a memmapped or lazily decoded source, the full conformed array never exists in memory)
+    frames are looked up in the track's clip table per request, so memory used is proportional to the frames asked for, not the timeline
+    supports len(), indexing with ints, slices, index arrays or bool masks (returning ndarrays), and iteration
+
+    track : Track or track_dict
+    source : indexable (time on 0th axis), or dict-like {producer : indexable} (same as conform_track_edit)
+    empty_value : value to fill blanks with
+    batch_size : number of frames to gather at once when iterating
+    transitions : list of Transitions to blend in (e.g. from get_transitions, with track from Project.composite)
+    blend : how to blend transitions, 'lerp' or 'slerp' (see blend_frames)
+    copy_threads : number of threads to split big copies across (see gather_frames)
+    '''
+    def __init__(self, track, source, empty_value=0, batch_size=64, special_keys=msa.mxml.default_special_keys, transitions=None, blend='lerp', copy_threads=1):
+        self.track = track if isinstance(track, Track) else Track.from_dict(track, special_keys=special_keys)
+        self.source = source
+        self.empty_value = empty_value
+        self.batch_size = batch_size
+        self.transitions = transitions or []
+        self.blend = blend
+        self.copy_threads = copy_threads
+        src = first_source(source, self.track.producers, self.track.producer_names)
+        self.shape = (self.track.length, ) + tuple(src.shape[1:])
+        self.dtype = src.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        '''number of bytes the view would take up if it was materialized'''
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0: key += len(self)
+            if key < 0 or key >= len(self): raise IndexError('index {} out of range for EditView with {} frames'.format(key, len(self)))
+            return self.gather(np.array([key]))[0]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1: return self.gather_range(start, stop)
+            return self.gather(np.arange(start, stop, step))
+
+        idx = np.asarray(key)
+        if idx.dtype == bool: idx = np.flatnonzero(idx)
+        idx = np.where(idx < 0, idx + len(self), idx)
+        if len(idx) and (idx.min() < 0 or idx.max() >= len(self)): raise IndexError('index out of range for EditView with {} frames'.format(len(self)))
+        return self.gather(idx)
+
+    def __iter__(self):
+        for i in range(0, len(self), self.batch_size):
+            for x in self[i:i+self.batch_size]: yield x
+
+    def __array__(self, dtype=None):
+        x = self[:]
+        return x if dtype is None else x.astype(dtype)
+
+    def gather(self, idx, out=None):
+        '''return ndarray of timeline frames idx (int array, must be in range), written into out if given'''
+        producers, frames = self.track.lookup(idx)
+        return self._gather(idx, producers, frames, out)
+
+    def gather_range(self, start, stop, out=None):
+        '''return ndarray of timeline frames start to stop (clipped to the track), written into out if given'''
+        producers, frames = self.track.frame_map(start, stop)
+        return self._gather(np.arange(start, start + len(frames)), producers, frames, out)
+
+    def _gather(self, idx, producers, frames, out):
+        out = gather_frames(self.source, producers, frames, producer_names=self.track.producer_names, empty_value=self.empty_value, out=out, copy_threads=self.copy_threads)
+        if self.transitions: apply_transitions(out, idx, self.transitions, self.source, blend=self.blend)
+        return out
+
+
+
+def conform_chunks(track, source, chunk_size=64, empty_value=0, transitions=None, blend='lerp', start=0, stop=None, reuse_buffer=False, copy_threads=1):
+    '''
+    generator conforming track onto source chunk_size frames at a time, yielding consecutive ndarrays of (up to) chunk_size frames
+    only one chunk (and its part of the frame map) exists at a time, so memory is bounded by chunk_size whatever the timeline length
+    e.g. to write to disk or feed to a model in batches:
+        with msa.kdenlive.open_writer(path, (track.length, ) + src.shape[1:], src.dtype) as writer:
+            for chunk in conform_chunks(track, src, 256): writer.write(chunk)
+    track, source, empty_value, transitions, blend, copy_threads : see EditView
+    start, stop : range of timeline frames to conform (default whole track)
+    reuse_buffer : if True, every chunk is written into (a view of) the same array, so nothing is allocated per chunk.
+        consumers must be done with a chunk before asking for the next one
+    '''
+    view = EditView(track, source, empty_value=empty_value, transitions=transitions, blend=blend, copy_threads=copy_threads)
+    stop = len(view) if stop is None else min(stop, len(view))
+    buf = np.empty((min(chunk_size, max(stop - start, 0)), ) + view.shape[1:], dtype=view.dtype) if reuse_buffer else None
+    for i in range(start, stop, chunk_size):
+        n = min(chunk_size, stop - i)
+        yield view.gather_range(i, i + n, out=buf[:n] if reuse_buffer else None)
+
+
+
+def conform_track_incremental(track, source, output_path, source_id='', empty_value=0, chunk_size=1024, special_keys=msa.mxml.default_special_keys, transitions=None, blend='lerp'):
+    '''
+    conform track onto source and write to npy at output_path, only rewriting frames which changed since the last time.
+    the clip table of the last conform is saved next to the output (see edit_info_path). If it exists, the output hasn't been
+    touched since (same size and modification time), and the source, empty_value, shape and dtype are the same, the old and new clip tables are diffed (see changed_ranges)
+    and only the timeline ranges which differ are gathered and written into the existing file (memmapped in place). Otherwise the whole file is (re)written.
+    source_id : string identifying the source contents (e.g. from file_id), if it changes everything is rewritten
+    transitions, blend : see EditView. frames under transitions are always rewritten (the tracks underneath may have changed)
+    returns dict with mode ('full', 'incremental' or 'unchanged'), frames (number of frames written) and ranges (number of changed ranges)
+    '''
+    if not isinstance(track, Track): track = Track.from_dict(track, special_keys=special_keys)
+    output_path = msa.fileio.expand(output_path)
+    view = EditView(track, source, empty_value=empty_value, batch_size=chunk_size, transitions=transitions, blend=blend)
+    meta = dict(source_id=source_id, empty_value=empty_value, shape=list(view.shape), dtype=str(np.dtype(view.dtype)), digest=track.digest(),
+                transitions=[[tr.start, tr.stop, tr.reverse, tr.a.digest(), tr.b.digest()] for tr in view.transitions], blend=blend)
+
+    old_track, old_meta = load_edit_info(output_path)
+    reason = None
+    if old_track is None: reason = 'no previous edit info'
+    elif not os.path.exists(output_path): reason = 'no previous output'
+    elif old_meta.get('output') != output_stamp(output_path): reason = 'output modified since last conform'
+    else:
+        for k in ['source_id', 'empty_value', 'shape', 'dtype', 'transitions', 'blend']:
+            if old_meta.get(k) != meta[k]: reason = '{} changed'.format(k)
+
+    if reason:
+        logger.info('Writing all {} frames to {} ({})'.format(len(view), output_path, reason))
+        msa.data.save_npy_in_batches(output_path, view, chunk_size)
+        save_edit_info(output_path, track, meta)
+        return dict(mode='full', frames=len(view), ranges=1)
+    
+    if old_meta.get('digest') == meta['digest'] and not view.transitions:
+        logger.info('Edit unchanged, nothing to write to {}'.format(output_path))
+        return dict(mode='unchanged', frames=0, ranges=0)
+
+    starts, stops = changed_ranges(old_track, track)
+    if view.transitions: # frames under transitions are always rewritten
+        starts, stops = _merge_ranges(np.r_[starts, [tr.start for tr in view.transitions]], np.r_[stops, [min(tr.stop, len(view)) for tr in view.transitions]])
+    num_frames = int((stops - starts).sum())
+    logger.info('Writing {} changed frames in {} ranges to {}'.format(num_frames, len(starts), output_path))
+    dst = np.lib.format.open_memmap(output_path, mode='r+')
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        for i in range(start, stop, chunk_size):
+            view.gather_range(i, min(i + chunk_size, stop), out=dst[i:min(i + chunk_size, stop)])
+    dst.flush()
+    del dst
+    save_edit_info(output_path, track, meta)
+    return dict(mode='incremental', frames=num_frames, ranges=len(starts))
+
+
+def changed_ranges(old_track, new_track):
+    '''
+    return (starts, stops), int arrays of sorted, non overlapping timeline ranges (stops exclusive) which show something different
+    in new_track compared to old_track (frames past the end of either track count as changed).
+    diffs the clip tables rather than frame maps: the timeline is cut at every row boundary of both tracks, and each piece is
+    unchanged if it shows the same producer at the same offset (or blanks in both). only pieces of rows with speed changes
+    which moved or changed are compared frame by frame, so it's O(rows) for most edits however long the track is
+    '''
+    length = max(old_track.length, new_track.length)
+    bounds = np.union1d(np.r_[old_track.starts, old_track.length, new_track.starts, new_track.length], [0])
+    bounds = bounds[bounds <= length]
+    seg_starts, seg_stops = bounds[:-1], bounds[1:]
+    old_rows, new_rows = old_track.rows_at(seg_starts), new_track.rows_at(seg_starts)
+
+    # producer ids may differ between tracks, so map old ids to new ids by name (-2 if not in new track, -3 and -4 past the end)
+    name_to_id = {n:i for i,n in enumerate(new_track.producer_names)}
+    old_to_new = np.array([name_to_id.get(n, -2) for n in old_track.producer_names] + [-1], dtype=np.int32) # index -1 (blank) maps to -1
+    old_producers = np.where(old_rows >= 0, old_to_new[old_track.producers[old_rows]], -3)
+    new_producers = np.where(new_rows >= 0, new_track.producers[new_rows], -4)
+
+    same = old_producers == new_producers
+    entries = same & (new_producers >= 0)
+    old_warped, new_warped = old_track.is_warped[old_rows] & entries, new_track.is_warped[new_rows] & entries
+    plain = entries & ~old_warped & ~new_warped
+    same_offset = old_track.ins[old_rows] - old_track.starts[old_rows] == new_track.ins[new_rows] - new_track.starts[new_rows]
+    changed = ~same | (plain & ~same_offset)
+
+    # warped in either track: unchanged if it's the same row in the same place, otherwise compare frame by frame
+    warped = old_warped | new_warped
+    identical = old_warped & new_warped & (old_track.starts[old_rows] == new_track.starts[new_rows]) & (old_track.ins[old_rows] == new_track.ins[new_rows]) \
+                & (old_track.speeds[old_rows] == new_track.speeds[new_rows]) & (old_track.phases[old_rows] == new_track.phases[new_rows])
+    check = np.flatnonzero(warped & ~identical)
+    frame_starts, frame_stops = np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    if len(check):
+        _, t = _expand_ranges(seg_starts[check], seg_stops[check])
+        t = t[old_track.lookup(t)[1] != new_track.lookup(t)[1]]
+        frame_starts, frame_stops = t, t + 1
+
+    return _merge_ranges(np.r_[seg_starts[changed], frame_starts], np.r_[seg_stops[changed], frame_stops])
+
+
+def changed_frames(old_track, new_track):
+    '''return sorted int array of timeline frames which show something different in new_track compared to old_track (see changed_ranges)'''
+    starts, stops = changed_ranges(old_track, new_track)
+    return _expand_ranges(starts, stops)[1]
+
+
+def _merge_ranges(starts, stops):
+    '''return (starts, stops) of ranges (stops exclusive) sorted and merged where they overlap or touch'''
+    starts, stops = np.asarray(starts, dtype=np.intp), np.asarray(stops, dtype=np.intp)
+    keep = stops > starts
+    starts, stops = starts[keep], stops[keep]
+    if not len(starts): return starts, stops
+    order = np.argsort(starts, kind='mergesort')
+    starts, stops = starts[order], np.maximum.accumulate(stops[order])
+    breaks = np.flatnonzero(starts[1:] > stops[:-1]) + 1
+    return starts[np.r_[0, breaks]], stops[np.r_[breaks - 1, len(starts) - 1]]
+
+
+def edit_info_path(output_path):
+    '''path to file storing the clip table of the last conform to output_path'''
+    return output_path + '.edit.npz'
+
+
+def output_stamp(output_path):
+    '''[size, modification time] of output_path, to tell if it was written by something else since save_edit_info'''
+    st = os.stat(output_path)
+    return [st.st_size, st.st_mtime]
+
+
+def save_edit_info(output_path, track, meta):
+    '''save clip table of track and meta (json serializable dict, output_stamp of output_path is added as 'output') next to output_path'''
+    import json
+    path = edit_info_path(output_path)
+    meta = dict(meta, output=output_stamp(output_path))
+    with open(path, 'wb') as f: # file object so np.savez doesn't add another extension
+        np.savez(f, producers=track.producers, ins=track.ins, outs=track.outs, lengths=track.lengths, speeds=track.speeds, phases=track.phases,
+                 producer_names=np.array(track.producer_names or [''], dtype=np.unicode_), meta=np.array(json.dumps(meta)))
+
+
+def load_edit_info(output_path):
+    '''return (Track, meta) saved by save_edit_info for output_path, or (None, None) if there isn't any (or it can't be read)'''
+    import json
+    path = edit_info_path(output_path)
+    if not os.path.exists(path): return None, None
+    try:
+        with np.load(path) as f:
+            warp = dict(speeds=f['speeds'], phases=f['phases']) if 'speeds' in f.files else {}
+            track = Track(f['producers'], f['ins'], f['outs'], f['lengths'], f['producer_names'].tolist(), **warp)
+            meta = json.loads(str(f['meta']))
+        return track, meta
+    except Exception as e:
+        logger.warning('Could not load {}: {}'.format(path, e))
+        return None, None
+
+
+def file_id(path):
+    '''string identifying the contents of a file (path, size and modification time) for conform_track_incremental'''
+    path = os.path.abspath(msa.fileio.expand(path))
+    st = os.stat(path)
+    return '{}:{}:{}'.format(path, st.st_size, int(st.st_mtime))
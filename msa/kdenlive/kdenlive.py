@@ -31,19 +31,24 @@ GOAL:
     3. Load EDL (not real EDL, kdenlive project) in python, conform with (apply edit to) z-npy
     4. Feed conformed z-npy back into model for render
     
-Currently supports very simple edits: cuts, joins, trims etc.
-No speed changes, no transitions, no effects
-Only tested with one track (should work with more).
+Currently supports simple edits: cuts, joins, trims etc, speed changes and reverse (timewarp producers), freeze frames,
+and compositing all tracks of a tractor (top most clip wins). No transitions, no other effects
 
 """
 
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
 
 from lxml import etree
 from collections import OrderedDict
+try: from collections.abc import Mapping # python 3
+except ImportError: from collections import Mapping # python 2
 import os
+import math
+import logging
+import hashlib
 import numpy as np
 
 import msa.mxml
@@ -51,37 +56,163 @@ import msa.data
 
 import msa.logger
 logger = msa.logger.getLogger(__name__)
+hot_logger = msa.logger.getHotLogger(__name__)
 
 KEY_NAME = 'name'
 KEY_TRACK_NAME = 'kdenlive:track_name'
 KEY_PRODUCER = 'producer'
 KEY_PLAYLIST = 'playlist'
+KEY_TRACTOR = 'tractor'
+KEY_TRACK = 'track'
+KEY_HIDE = 'hide'
 KEY_LENGTH = 'length'
 KEY_CHILDREN = 'children'
 KEY_IN = 'in'
 KEY_OUT = 'out'
 KEY_START = 'start'
+KEY_ROOT = 'root'
+KEY_RESOURCE = 'resource'
+KEY_SERVICE = 'mlt_service'
+KEY_WARP_SPEED = 'warp_speed'
+KEY_WARP_RESOURCE = 'warp_resource'
+KEY_SPEED = 'speed' # only in dicts returned by Track.to_dict
+KEY_PHASE = 'phase' # only in dicts returned by Track.to_dict
+
+# only tags needed for producers, tracks, freeze frames and transitions (e.g. Project(path, include_tags=PROJECT_TAGS) skips anything else)
+PROJECT_TAGS = ['property', 'entry', 'blank', 'track', 'filter', 'transition']
 
 
 class Project:
-    def __init__(self, xml_path):
-        self.tree = etree.parse(os.path.expanduser(os.path.expandvars(xml_path)))
-        self.root = self.tree.getroot()
+    def __init__(self, xml_path, streaming=False, producer_ids=None, track_names=None, include_tags=None):
+        '''
+        load and parse a kdenlive project
+        streaming : if True, stream the xml with iterparse instead of building the whole tree.
+            elements are cleared as soon as they're consumed so peak memory stays roughly flat for huge projects
+            (self.tree and self.root will be None)
+        producer_ids : list of producer ids to load (None for all)
+        track_names : list of track names to load (None for all playlists, otherwise only matching tracks are kept)
+        include_tags : list of tags to convert inside producers and playlists (None for all, PROJECT_TAGS for only what's needed for the tracks)
+        '''
+        self.path = os.path.expanduser(os.path.expandvars(xml_path))
+        filter_fn = _project_filter(producer_ids, track_names)
         
-        # list of producers (i.e. media)
-        self.producers = msa.mxml.children_by_key(self.root, KEY_PRODUCER, add_empty=False)
+        if streaming:
+            self.tree = self.root = None
+            self.attrib = msa.mxml.root_attrib(self.path)
+            self.producers, self.playlists, self.tractors = OrderedDict(), OrderedDict(), OrderedDict()
+            dst = {KEY_PRODUCER:self.producers, KEY_PLAYLIST:self.playlists, KEY_TRACTOR:self.tractors}
+            with msa.logger.span('project.stream_xml_to_dicts'): # parsing and dict conversion are interleaved
+                for tag, k, d in msa.mxml.iter_children_by_key(self.path, [KEY_PRODUCER, KEY_PLAYLIST, KEY_TRACTOR], filter_fn=filter_fn, add_empty=False, include_tags=include_tags):
+                    dst[tag][k] = d
+                
+        else:
+            with msa.logger.span('project.parse_xml') as s:
+                self.tree = etree.parse(self.path)
+                s.add_bytes(os.path.getsize(self.path))
+            self.root = self.tree.getroot()
+            self.attrib = dict(self.root.attrib)
         
-        # playlists include tracks, and also media bin etc
-        self.playlists = msa.mxml.children_by_key(self.root, KEY_PLAYLIST, add_empty=False)
+            with msa.logger.span('project.xml_to_dicts'):
+                # list of producers (i.e. media)
+                self.producers = msa.mxml.children_by_key(self.root, KEY_PRODUCER, filter_fn=filter_fn, add_empty=False, include_tags=include_tags)
+            
+                # playlists include tracks, and also media bin etc
+                self.playlists = msa.mxml.children_by_key(self.root, KEY_PLAYLIST, filter_fn=filter_fn, add_empty=False, include_tags=include_tags)
+                
+                # tractors stack tracks (and other tractors) on top of each other
+                self.tractors = msa.mxml.children_by_key(self.root, KEY_TRACTOR, filter_fn=filter_fn, add_empty=False, include_tags=include_tags)
         
         # get track playlists, and update start, duration info etc.
         # tracks are in reverse order (bottom to top)
-        self.tracks = OrderedDict([(k,v) for k,v in self.playlists.items() if k.startswith(KEY_PLAYLIST)])
-        map(update_track_properties, self.tracks.values())
-        map(update_track_info, self.tracks.values())
+        with msa.logger.span('project.update_track_info'):
+            self.tracks = OrderedDict([(k,v) for k,v in self.playlists.items() if k.startswith(KEY_PLAYLIST)])
+            map(update_track_properties, self.tracks.values())
+            map(update_track_info, self.tracks.values())
+        
+        # compact typed version of the tracks (parallel numpy arrays instead of dicts)
+        with msa.logger.span('project.timeline'):
+            self.timeline = Timeline.from_dicts(self.tracks, producers=self.producers)
+        
+        # folder media resources are relative to
+        self.root_dir = self.attrib.get(KEY_ROOT, os.path.dirname(self.path))
         
+        # indexes, so lookups don't need to scan CHILDREN lists
+        # {producer or playlist id : {property name : value}}, {track name : [track ids]}, {resource : [producer ids]}
+        with msa.logger.span('project.index'):
+            self.properties = OrderedDict((k, element_properties(v)) for d in [self.producers, self.playlists] for k,v in d.items())
+            self.tracks_by_name = _index_by_property(self.properties, self.tracks.keys(), KEY_TRACK_NAME)
+            self.producers_by_resource = _index_by_property(self.properties, self.producers.keys(), KEY_RESOURCE)
         
+    def get_property(self, element_id, name, default=None):
+        '''return value of property name of producer or playlist element_id (or default if it doesn't have it)'''
+        return self.properties.get(element_id, {}).get(name, default)
+    
+    def find_tracks_by_name(self, name):
+        '''return list of track_dicts with track name (exact match)'''
+        return [self.tracks[k] for k in self.tracks_by_name.get(name, [])]
+    
+    def find_producers_by_resource(self, resource):
+        '''return list of producer dicts using resource (exact match, as it's written in the project)'''
+        return [self.producers[k] for k in self.producers_by_resource.get(resource, [])]
+    
+    def get_tractor_track_ids(self, tractor_id=None, special_keys=msa.mxml.default_special_keys):
+        '''
+        return ids of the tracks stacked in tractor_id (default the main tractor, i.e. the last one), bottom to top
+        nested tractors are expanded in place. tracks hidden for video, and anything which isn't a track (e.g. black_track) are skipped
+        '''
+        if tractor_id is None:
+            if not self.tractors: raise KeyError('No tractor in {}'.format(self.path))
+            tractor_id = next(reversed(self.tractors))
+        ids = []
+        for c in self.tractors[tractor_id].get(special_keys[KEY_CHILDREN], []):
+            if c.get(special_keys['tag']) != KEY_TRACK or c.get(KEY_HIDE) in ['video', 'both']: continue
+            k = c.get(KEY_PRODUCER)
+            if k in self.tractors: ids += self.get_tractor_track_ids(k, special_keys=special_keys)
+            elif k in self.timeline.tracks: ids.append(k)
+        return ids
+    
+    def composite(self, tractor_id=None):
+        '''return Track compositing all tracks of tractor_id (default the main tractor) into one, see composite_tracks'''
+        ids = self.get_tractor_track_ids(tractor_id)
+        logger.debug('Compositing tracks {}'.format(ids))
+        return composite_tracks([self.timeline[k] for k in ids], producer_names=self.timeline.producer_names)
+        
+    def __getstate__(self):
+        '''for pickling (e.g. msa.kdenlive.load_project). lxml trees can't be pickled, so drop them (as if loaded with streaming=True)'''
+        d = dict(self.__dict__)
+        d['tree'] = d['root'] = None
+        return d
+        
+
+def _project_filter(producer_ids=None, track_names=None):
+    '''return filter_fn for msa.mxml.children_by_key / iter_children_by_key which only keeps the requested producers and tracks'''
+    if producer_ids is None and track_names is None: return None
+    if producer_ids is not None: producer_ids = set(producer_ids)
+    if track_names is not None: track_names = set(track_names)
+    
+    def filter_fn(tag, key, e):
+        if tag == KEY_PRODUCER: return producer_ids is None or key in producer_ids
+        if tag == KEY_PLAYLIST and track_names is not None:
+            return key.startswith(KEY_PLAYLIST) and e.findtext('property[@name="{}"]'.format(KEY_TRACK_NAME)) in track_names
+        return True
+    return filter_fn
+    
         
+def _index_by_property(properties, ids, name):
+    '''return ordered dict {value : [ids]} for property name of each id in ids (skipping those without it)'''
+    index = OrderedDict()
+    for k in ids:
+        v = properties[k].get(name)
+        if v is not None: index.setdefault(v, []).append(k)
+    return index
+
+
+def element_properties(element_dict, special_keys=msa.mxml.default_special_keys):
+    '''return dict {name : value} of the property children of element_dict (e.g. a producer or playlist). empty properties are '' '''
+    value_key = special_keys['value']
+    return {c[KEY_NAME]:c.get(value_key, '') for c in element_dict.get(special_keys[KEY_CHILDREN], []) if KEY_NAME in c}
+    
+
 def update_track_properties(track_dict, special_keys=msa.mxml.default_special_keys):
     '''extract track property children into root of dict'''
     return msa.data.list_to_dict_by_key(track_dict[special_keys[KEY_CHILDREN]], name_key=KEY_NAME, value_key=special_keys['value'], d=track_dict)
@@ -137,37 +268,514 @@ After this function, becomes:
     track_dict[KEY_LENGTH] = start
 
             
-def conform_track_edit(track_dict, source, special_keys=msa.mxml.default_special_keys, empty_value=0):
+def conform_track_edit(track_dict, source, special_keys=msa.mxml.default_special_keys, empty_value=0, copy_threads=1):
     '''
-    given a track_dict, apply edit to indexable source (time is on the 0th axis)
+    given a track_dict (or Track), apply edit to indexable source (time is on the 0th axis)
     return ndarray edited
     if source is a dict treat it as {producer : indexable}, otherwise use it as is
     fill the empty parts of target with empty_value
+    copy_threads : number of threads to split big copies across (see gather_frames)
+    speed changes and reverse are only known to Tracks created with the project's producers (e.g. from Project.timeline)
+    
+    builds a single frame index map for the whole track (see Track.frame_map), then fills the target 
+    with one gather (np.take) per producer, and the blanks with one masked assignment.
     '''
     if len(source) == 0: return None
-    
-    #create empty return ndarray of correct length and shape
-    target = np.zeros((track_dict[KEY_LENGTH], ) + source.shape[1:], dtype=source.dtype)
-    if empty_value: target.fill(empty_value)
-    children_key = special_keys[KEY_CHILDREN]
-    for c in track_dict[children_key]:
-        if all([x in c for x in [KEY_OUT, KEY_IN, KEY_LENGTH, KEY_START]]):  
-            i,s,l = c[KEY_IN], c[KEY_START], c[KEY_LENGTH]
-            logger.debug('Applying edit in:{} length:{} to start:{}', i, l, s)
-            src = source[c[KEY_PRODUCER]] if type(source)==dict else source
-            target[s:s+l] = src[i:i+l]
-    
-    return target
+    with msa.logger.span('conform.frame_map'):
+        track = track_dict if isinstance(track_dict, Track) else Track.from_dict(track_dict, special_keys=special_keys)
+        producers, frames = track.frame_map()
+    return gather_frames(source, producers, frames, producer_names=track.producer_names, empty_value=empty_value, copy_threads=copy_threads)
+
+
+def gather_frames(source, producers, frames, producer_names=None, empty_value=0, out=None, copy_threads=1):
+    '''
+    gather frames from source into out (allocated if None), with one np.take per producer
+    source : indexable (time on 0th axis), or dict-like {producer : indexable} (e.g. dict or SourceRegistry)
+    producers, frames : int arrays (e.g. from Track.frame_map). frames < 0 are blanks and filled with empty_value
+    producer_names : maps producers to keys in source (only needed if source is a dict)
+        producers which aren't in a dict source (e.g. color clips, which SourceRegistry has no media for) are filled with empty_value too
+    copy_threads : number of threads to split takes from ndarray (or memmap) sources across (None for cpu count, see msa.data.parallel_take)
+        only helps for big frames (e.g. HD or 4K video), where a single core can't saturate memory bandwidth
+    '''
+    with msa.logger.span('conform.gather_frames') as span:
+        blanks = frames < 0
+        if out is None:
+            src = first_source(source, producers, producer_names)
+            out = np.empty((len(frames), ) + tuple(src.shape[1:]), dtype=src.dtype)
+
+        if not is_multi_source(source):
+            if isinstance(source, np.ndarray): 
+                # single array, gather everything in one go (blanks temporarily read frame 0)
+                if len(frames): _take(source, np.where(blanks, 0, frames), out=out, num_threads=copy_threads)
+            else:
+                # lazy sources (e.g. VideoReader) should only ever be asked for frames that are used
+                idx = np.flatnonzero(~blanks)
+                if len(idx): out[idx] = _take(source, frames[idx])
+
+        else:
+            debug = hot_logger.is_enabled(logging.DEBUG)
+            for p in np.unique(producers[~blanks]).tolist():
+                idx = np.flatnonzero(producers == p)
+                if producer_names[p] not in source:
+                    hot_logger.warning('No source for producer {}, filling its frames with {}', producer_names[p], empty_value, max_per_sec=1)
+                    out[idx] = empty_value
+                    continue
+                if debug: hot_logger.debug('Applying edits from producer {}', producer_names[p], frames=len(idx))
+                if idx[-1] - idx[0] + 1 == len(idx): _take(source[producer_names[p]], frames[idx], out=out[idx[0]:idx[-1]+1], num_threads=copy_threads) # contiguous, straight into out
+                else: out[idx] = _take(source[producer_names[p]], frames[idx], num_threads=copy_threads)
+
+        out[blanks] = empty_value
+        span.add_bytes(out.nbytes)
+    return out
+
+
+def is_multi_source(source):
+    '''True if source is dict-like {producer : indexable} (e.g. dict or SourceRegistry), False if it's a single indexable'''
+    return isinstance(source, Mapping)
+
+
+def first_source(source, producers=None, producer_names=None):
+    '''return the first indexable in source which is actually used (if producers given), e.g. to get shape and dtype'''
+    if not is_multi_source(source): return source
+    if producers is not None:
+        for p in np.unique(producers[producers >= 0]).tolist():
+            if producer_names[p] in source: return source[producer_names[p]]
+    return next(iter(source.values()))
+
+
+def _take(src, idx, out=None, num_threads=1):
+    '''src[idx] along 0th axis, using np.take if src is an ndarray (or memmap, split across num_threads), fancy indexing otherwise'''
+    if isinstance(src, np.ndarray):
+        if len(idx) and idx.max() >= len(src): raise IndexError('frame {} out of range for source with {} frames'.format(idx.max(), len(src)))
+        if num_threads != 1: return msa.data.parallel_take(src, idx, out=out, num_threads=num_threads)
+        return np.take(src, idx, axis=0, out=out, mode='clip') # bounds already checked, and mode='raise' would buffer out
+    x = src[idx]
+    if out is None: return x
+    out[...] = x
+    return out
 
 
 def get_track_names(tracks):
+    if isinstance(tracks, Timeline): return tracks.get_names()
+    if isinstance(tracks, Project): tracks = tracks.tracks
     return [t[KEY_TRACK_NAME] for _,t in tracks.iteritems()]
 
             
 def find_tracks_by_name(tracks, name, exact=True):
+    if isinstance(tracks, Timeline): return tracks.find_by_name(name, exact=exact)
+    if isinstance(tracks, Project):
+        if exact: return tracks.find_tracks_by_name(name)
+        tracks = tracks.tracks
     return msa.data.find_by_key_in_dict_list(tracks.values(), target=name, key=KEY_TRACK_NAME, exact=exact)
  
 
+def producer_warp(producer_dict, special_keys=msa.mxml.default_special_keys):
+    '''return (speed, length) if producer_dict is a timewarp producer (speed change, negative for reverse), otherwise None'''
+    props = element_properties(producer_dict, special_keys=special_keys)
+    if props.get(KEY_SERVICE) != 'timewarp': return None
+    speed = props.get(KEY_WARP_SPEED) or props.get(KEY_RESOURCE, '1:').split(':')[0] # resource is 'speed:path'
+    length = props.get(KEY_LENGTH) or int(producer_dict.get(KEY_OUT, 0)) + 1
+    return float(speed), int(length)
+
+
+def entry_freeze(entry_dict, special_keys=msa.mxml.default_special_keys):
+    '''return (frame, freeze_before, freeze_after) of freeze filter on entry_dict (frame relative to entry in point), or None if there isn't one'''
+    for c in entry_dict.get(special_keys[KEY_CHILDREN], []):
+        if c.get(special_keys['tag']) != 'filter': continue
+        props = element_properties(c, special_keys=special_keys)
+        if props.get(KEY_SERVICE) == 'freeze':
+            return int(props.get('frame') or 0), props.get('freeze_before') == '1', props.get('freeze_after') == '1'
+    return None
+
+
+WARP_EPSILON = 1e-6 # so speeds which aren't exact in floating point (e.g. 1/3) don't round down a frame
+
+def _warp_rows(producer, i, o, warp, freeze):
+    '''
+    return rows (producer, in, length, speed, phase) in source frames for an entry showing producer frames i to o (inclusive)
+    warp : (speed, length) from producer_warp (or None), freeze : (frame, freeze_before, freeze_after) from entry_freeze (or None)
+    '''
+    # source frame shown for producer frame p is floor(a + b * p)
+    a, b = 0., 1.
+    if warp:
+        speed, length = warp
+        a, b = ((length - 1) * -speed, speed) if speed < 0 else (0., speed)
+    
+    # split into normal and frozen segments (f is the frozen producer frame)
+    f, segments = None, [(i, o, False)]
+    if freeze:
+        f = min(max(i + freeze[0], i), o)
+        before, after = freeze[1], freeze[2]
+        if not before and not after: segments = [(i, o, True)]
+        else: segments = [(i, f-1, before), (f, f, False), (f+1, o, after)]
+    
+    rows = []
+    for first, last, frozen in segments:
+        if last < first: continue
+        offset = a + b * (f if frozen else first)
+        start = int(math.floor(offset + WARP_EPSILON))
+        if frozen: rows.append((producer, start, last - first + 1, 0., 0.))
+        else: rows.append((producer, start, last - first + 1, b, offset - start))
+    return rows
+
+
+def composite_tracks(tracks, producer_names=None):
+    '''
+    flatten list of Tracks (bottom to top) into a single Track showing the top most clip at every frame
+    blanks are transparent (lower tracks show through), and transitions are ignored (i.e. treated as hard cuts).
+    the result can be conformed in one pass like any other track (e.g. with conform_track_edit, EditView)
+    tracks must share producer_names (e.g. all from the same Timeline)
+    '''
+    if producer_names is None: producer_names = tracks[0].producer_names if tracks else []
+    if any(t.producer_names is not producer_names for t in tracks): raise ValueError('tracks must share producer_names (e.g. from the same Timeline)')
+    length = max([t.length for t in tracks] + [0])
+    producers, frames = np.full(length, -1, dtype=np.int32), np.full(length, -1, dtype=np.intp)
+    for t in tracks:
+        p, f = t.frame_map()
+        idx = np.flatnonzero(p >= 0)
+        producers[idx], frames[idx] = p[idx], f[idx]
+    return Track.from_frame_map(producers, frames, producer_names, properties=OrderedDict([(KEY_TRACK_NAME, u'+'.join(u'{}'.format(t.name) for t in reversed(tracks)))]))
+
+
+
+def _expand_ranges(lo, hi):
+    '''return (queries, positions) listing every position in [lo[q], hi[q]) for each q (vectorized)'''
+    counts = np.maximum(hi - lo, 0)
+    queries = np.repeat(np.arange(len(counts), dtype=np.intp), counts)
+    return queries, np.arange(counts.sum(), dtype=np.intp) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+
+
+
+class Track(object):
+    '''
+    compact typed version of a track_dict. The clip table is stored as parallel numpy arrays, one row per entry or blank
+        producers : index into producer_names (-1 for blanks)
+        ins, outs : first and last source frame shown by entries (inclusive, -1 for blanks. outs < ins if reversed)
+        starts : timeline frame each row starts on
+        lengths : number of frames in each row
+        speeds, phases : for speed changes, reverse and freeze frames. the k'th frame of a row shows source frame
+            ins + floor(phases + k * speeds), i.e. speeds is 1 for normal playback, 0 for freeze frames, negative for reverse
+    so a 100k clip track fits in a couple of MB and can be queried with vectorized numpy ops.
+    starts is sorted, so random access queries are binary searches: lookup (timeline frames -> producer and source frames),
+    rows_in_range, and find_source_frames (source frames -> all timeline frames showing them).
+    properties (e.g. kdenlive:track_name) are kept in an OrderedDict, other attributes (e.g. id) in attrib.
+    to_dict() returns the same dict view as update_track_properties + update_track_info for backwards compatibility
+    (property children first, then entries and blanks. Anything else, e.g. effects on entries, is dropped)
+    '''
+    def __init__(self, producers, ins, outs, lengths, producer_names, properties=None, attrib=None, speeds=None, phases=None):
+        self.producers = np.asarray(producers, dtype=np.int32)
+        self.ins = np.asarray(ins, dtype=np.int32)
+        self.outs = np.asarray(outs, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.speeds = np.ones(len(self.lengths)) if speeds is None else np.asarray(speeds, dtype=np.float64)
+        self.phases = np.zeros(len(self.lengths)) if phases is None else np.asarray(phases, dtype=np.float64)
+        self.starts = np.zeros_like(self.lengths)
+        np.cumsum(self.lengths[:-1], out=self.starts[1:])
+        self.producer_names = producer_names # list, can be shared between tracks
+        self.properties = properties if properties is not None else OrderedDict()
+        self.attrib = attrib if attrib is not None else {}
+        self._source_index = None # built on demand by find_source_frames
+
+
+    @classmethod
+    def from_dict(cls, track_dict, producer_names=None, special_keys=msa.mxml.default_special_keys, producers=None):
+        '''
+        create from a track_dict (doesn't matter if update_track_properties / update_track_info have been run or not)
+        producer_names : list to look up (and append new) producer names in. Pass the same list to share ids between tracks
+        producers : dict of producer dicts (e.g. Project.producers) to find speed changes and reverse (timewarp producers) in
+        freeze frames are read from freeze filters on the entries
+        '''
+        tag_key, children_key, value_key = special_keys['tag'], special_keys[KEY_CHILDREN], special_keys['value']
+        if producer_names is None: producer_names = []
+        producer_ids = {k:i for i,k in enumerate(producer_names)}
+        warps = {}
+        properties = OrderedDict()
+        rows = []
+        for c in track_dict.get(children_key, []):
+            if KEY_IN in c and KEY_OUT in c: # same logic as update_track_info
+                i, o = int(c[KEY_IN]), int(c[KEY_OUT])
+                p = c[KEY_PRODUCER]
+                if p not in producer_ids:
+                    producer_ids[p] = len(producer_names)
+                    producer_names.append(p)
+                if o < i: continue
+                if KEY_SPEED in c: # from to_dict
+                    rows.append((producer_ids[p], i, o - i + 1, float(c[KEY_SPEED]), float(c.get(KEY_PHASE, 0))))
+                    continue
+                if p not in warps: warps[p] = producer_warp(producers[p], special_keys=special_keys) if producers and p in producers else None
+                freeze = entry_freeze(c, special_keys=special_keys) if children_key in c else None
+                if warps[p] is None and freeze is None: rows.append((producer_ids[p], i, o - i + 1, 1., 0.))
+                else: rows += _warp_rows(producer_ids[p], i, o, warps[p], freeze)
+            elif KEY_LENGTH in c:
+                if int(c[KEY_LENGTH]): rows.append((-1, -1, int(c[KEY_LENGTH]), 1., 0.))
+            elif c.get(tag_key) == 'property' and KEY_NAME in c:
+                properties[c[KEY_NAME]] = c.get(value_key)
+        
+        attrib = {k:v for k,v in track_dict.items() if k != children_key}
+        table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        producers_col, ins, lengths, speeds, phases = table[:,0], table[:,1], table[:,2], table[:,3], table[:,4]
+        outs = np.where(producers_col < 0, -1, ins + np.floor(phases + (lengths - 1) * speeds + WARP_EPSILON))
+        return cls(producers_col, ins, outs, lengths, producer_names, properties=properties, attrib=attrib, speeds=speeds, phases=phases)
+
+
+
+    @classmethod
+    def from_frame_map(cls, producers, frames, producer_names, properties=None, attrib=None):
+        '''create from per frame producers and source frames (same as returned by frame_map), merging runs of consecutive frames into rows'''
+        producers, frames = np.asarray(producers), np.asarray(frames)
+        n = len(producers)
+        breaks = np.flatnonzero((producers[1:] != producers[:-1]) | ((producers[1:] >= 0) & (frames[1:] != frames[:-1] + 1))) + 1
+        starts = np.r_[0, breaks] if n else np.zeros(0, dtype=np.intp)
+        lengths = np.diff(np.r_[starts, n])
+        rows_producers = producers[starts]
+        ins = np.where(rows_producers < 0, -1, frames[starts])
+        outs = np.where(rows_producers < 0, -1, ins + lengths - 1)
+        return cls(rows_producers, ins, outs, lengths, producer_names, properties=properties, attrib=attrib)
+
+
+    def to_dict(self, special_keys=msa.mxml.default_special_keys):
+        '''return the dict view of this track (same as a track_dict after update_track_properties and update_track_info)'''
+        tag_key, children_key, value_key = special_keys['tag'], special_keys[KEY_CHILDREN], special_keys['value']
+        children = []
+        for k,v in self.properties.items():
+            c = {tag_key:'property', KEY_NAME:k}
+            if v is not None: c[value_key] = v
+            children.append(c)
+
+        warped = self.is_warped
+        for r, (p, i, o, s, l) in enumerate(zip(self.producers.tolist(), self.ins.tolist(), self.outs.tolist(), self.starts.tolist(), self.lengths.tolist())):
+            if p < 0: children.append({tag_key:'blank', KEY_LENGTH:l, KEY_START:s})
+            elif not warped[r]: children.append({tag_key:'entry', KEY_IN:i, KEY_OUT:o, KEY_PRODUCER:self.producer_names[p], KEY_LENGTH:l, KEY_START:s})
+            else: # in and out are only approximate, speed and phase are needed to recreate it
+                children.append({tag_key:'entry', KEY_IN:i, KEY_OUT:i+l-1, KEY_PRODUCER:self.producer_names[p], KEY_LENGTH:l, KEY_START:s,
+                                 KEY_SPEED:float(self.speeds[r]), KEY_PHASE:float(self.phases[r])})
+            
+        d = dict(self.attrib)
+        d[children_key] = children
+        d.update((k,v) for k,v in self.properties.items() if v is not None)
+        d[KEY_LENGTH] = self.length
+        return d
+
+
+    def __len__(self):
+        '''number of rows (entries and blanks)'''
+        return len(self.lengths)
+    
+    @property
+    def length(self):
+        '''total length of track in frames'''
+        return int(self.starts[-1] + self.lengths[-1]) if len(self) else 0
+    
+    @property
+    def name(self):
+        return self.properties.get(KEY_TRACK_NAME)
+    
+    @property
+    def id(self):
+        return self.attrib.get('id')
+    
+    @property
+    def is_blank(self):
+        '''bool mask of blank rows'''
+        return self.producers < 0
+    
+    @property
+    def is_warped(self):
+        '''bool mask of rows which aren't played at normal speed (speed changes, reverse, freeze frames)'''
+        return (self.speeds != 1) | (self.phases != 0)
+    
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.producers, self.ins, self.outs, self.starts, self.lengths, self.speeds, self.phases])
+    
+    def digest(self):
+        '''return sha1 hex digest of the clip table (producer names, ins, outs, lengths), i.e. changes if and only if the edit changes'''
+        # producer_names may be shared with other tracks, so renumber producers to only the ones used here
+        used = np.unique(self.producers[self.producers >= 0])
+        producers = np.where(self.producers < 0, -1, np.searchsorted(used, self.producers)).astype(np.int32)
+        h = hashlib.sha1()
+        for a in [producers, self.ins, self.outs, self.lengths]: h.update(np.ascontiguousarray(a).tobytes())
+        if self.is_warped.any(): # so digests of tracks without speed changes don't change
+            for a in [self.speeds, self.phases]: h.update(np.ascontiguousarray(a).tobytes())
+        h.update('\n'.join(self.producer_names[p] for p in used.tolist()).encode('utf-8'))
+        return h.hexdigest()
+    
+    def row_map(self):
+        '''return int array with the row index for every frame on the timeline'''
+        return np.repeat(np.arange(len(self), dtype=np.intp), self.lengths)
+    
+    def frame_map(self, start=0, stop=None):
+        '''
+        return (producers, frames), two int arrays with an element for every frame on the timeline (or timeline frames start to stop)
+            producers : index into producer_names (-1 for blanks)
+            frames : frame in source to show (-1 for blanks)
+        '''
+        start, stop = max(start, 0), self.length if stop is None else min(stop, self.length)
+        rows = self.rows_in_range(start, stop)
+        counts = np.minimum(self.starts[rows] + self.lengths[rows], stop) - np.maximum(self.starts[rows], start)
+        rows = np.repeat(rows, counts)
+        producers = self.producers[rows]
+        frames = self._source_frames(rows, np.arange(start, start + len(rows), dtype=np.intp) - self.starts[rows])
+        frames[producers < 0] = -1
+        return producers, frames
+    
+    def _source_frames(self, rows, offsets):
+        '''return source frames shown offsets frames into rows (int arrays)'''
+        frames = self.ins[rows] + offsets
+        warped = self.is_warped
+        if warped.any():
+            idx = np.flatnonzero(warped[rows])
+            r = rows[idx]
+            frames[idx] = self.ins[r] + np.floor(self.phases[r] + offsets[idx] * self.speeds[r] + WARP_EPSILON).astype(frames.dtype)
+        return frames
+    
+    def rows_at(self, frames):
+        '''return row index shown at timeline frame(s) (int or int array), -1 for frames outside the track. O(log n) per frame'''
+        t = np.asarray(frames)
+        rows = np.searchsorted(self.starts, t, side='right') - 1
+        rows = np.where((t < 0) | (t >= self.length), -1, rows)
+        return int(rows) if rows.ndim == 0 else rows
+    
+    def lookup(self, frames):
+        '''
+        return (producers, source frames) shown at timeline frame(s) (int or int array), -1 for blanks and frames outside the track
+        same as indexing the arrays returned by frame_map, without building them (e.g. for scrubbing)
+        '''
+        t = np.asarray(frames)
+        if not len(self): return (-1, -1) if t.ndim == 0 else (np.full(t.shape, -1, dtype=np.intp), np.full(t.shape, -1, dtype=np.intp))
+        rows = np.atleast_1d(self.rows_at(t))
+        valid = rows >= 0
+        producers = np.where(valid, self.producers[rows], -1)
+        source_frames = np.where(valid & (producers >= 0), self._source_frames(rows, t - self.starts[rows]), -1)
+        if t.ndim == 0: return int(producers[0]), int(source_frames[0])
+        return producers, source_frames
+    
+    def rows_in_range(self, start, stop):
+        '''return int array of rows overlapping timeline frames start to stop (exclusive)'''
+        start, stop = max(start, 0), min(stop, self.length)
+        if start >= stop: return np.arange(0, dtype=np.intp)
+        return np.arange(np.searchsorted(self.starts, start, side='right') - 1, np.searchsorted(self.starts, stop, side='left'), dtype=np.intp)
+    
+    def find_source_frames(self, producer_name, frames):
+        '''
+        reverse lookup: timeline frames showing source frame(s) of producer_name (each can be used any number of times, or not at all)
+        frames : int or int array of source frames
+        returns (queries, timeline_frames), int arrays with an element per occurrence, sorted by query then time.
+            i.e. frames[queries[j]] is shown at timeline frame timeline_frames[j]
+        '''
+        frames = np.atleast_1d(np.asarray(frames, dtype=np.intp))
+        if self._source_index is None: self._source_index = self._build_source_index()
+        if producer_name not in self._source_index: return np.arange(0, dtype=np.intp), np.arange(0, dtype=np.intp)
+
+        # rows are grouped by how many source frames they span (powers of 2), and sorted by first source frame in each group,
+        # so rows which can contain frame f have firsts in [f - max span + 1, f]. at least half that window contains f for
+        # rows spanning up to 2x the group's minimum, so it's O(log n) per group plus the occurrences, however long the longest clip is
+        queries, candidates = [], []
+        for rows, firsts, max_span in self._source_index[producer_name]:
+            q, c = _expand_ranges(np.searchsorted(firsts, frames - max_span + 1, side='left'), np.searchsorted(firsts, frames, side='right'))
+            queries.append(q)
+            candidates.append(rows[c])
+        queries, candidates = np.concatenate(queries), np.concatenate(candidates)
+        f = frames[queries]
+        keep = f <= np.maximum(self.ins[candidates], self.outs[candidates])
+        queries, candidates, f = queries[keep], candidates[keep], f[keep]
+
+        # offsets into each row which can show f. exact for rows at normal speed, otherwise a range around
+        # the solution of ins + phases + k * speeds = f (or the whole row for freeze frames), checked with _source_frames below
+        lo, hi = f - self.ins[candidates], f - self.ins[candidates] + 1
+        warped = self.is_warped[candidates]
+        if warped.any():
+            w = np.flatnonzero(warped)
+            r = candidates[w]
+            speeds, base = self.speeds[r], (f[w] - self.ins[r] - self.phases[r]).astype(np.float64)
+            frozen = speeds == 0
+            speeds = np.where(frozen, 1, speeds)
+            a, b = base / speeds, (base + 1) / speeds
+            lo[w] = np.where(frozen, 0, np.floor(np.minimum(a, b)) - 1)
+            hi[w] = np.where(frozen, self.lengths[r], np.ceil(np.maximum(a, b)) + 2)
+        lo, hi = np.maximum(lo, 0), np.minimum(hi, self.lengths[candidates])
+        pairs, offsets = _expand_ranges(lo, hi)
+        candidates = candidates[pairs]
+        keep = self._source_frames(candidates, offsets) == f[pairs]
+        queries, timeline_frames = queries[pairs][keep], self.starts[candidates][keep] + offsets[keep]
+
+        order = np.lexsort((timeline_frames, queries))
+        return queries[order], timeline_frames[order]
+
+    def _build_source_index(self):
+        '''
+        {producer_name : [(rows sorted by first source frame, their first source frames, max span) per group]} for find_source_frames
+        rows of each producer are grouped by floor(log2(span)), where span is the number of source frames from first to last
+        (min and max of ins and outs, so reversed rows are included)
+        '''
+        index = {}
+        firsts_all, lasts_all = np.minimum(self.ins, self.outs), np.maximum(self.ins, self.outs)
+        spans_all = lasts_all - firsts_all + 1
+        groups_all = np.floor(np.log2(np.maximum(spans_all, 1))).astype(np.intp)
+        for p in np.unique(self.producers[self.producers >= 0]).tolist():
+            rows = np.flatnonzero(self.producers == p)
+            rows = rows[np.lexsort((firsts_all[rows], groups_all[rows]))]
+            bounds = np.r_[0, np.flatnonzero(np.diff(groups_all[rows])) + 1, len(rows)]
+            index[self.producer_names[p]] = [(rows[i:j], firsts_all[rows[i:j]], int(spans_all[rows[i:j]].max())) for i, j in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+        return index
+
+    def source_ranges(self):
+        '''
+        return list of (producer_name, in, out) source frame ranges (inclusive) used by the track, sorted and merged where they overlap or touch
+        (rows sped up more than 1x don't use every frame in their range, but the whole range is included)
+        '''
+        ranges = []
+        firsts_all, lasts_all = np.minimum(self.ins, self.outs), np.maximum(self.ins, self.outs) # reversed rows have outs < ins
+        for p in np.unique(self.producers[self.producers >= 0]).tolist():
+            m = self.producers == p
+            order = np.argsort(firsts_all[m], kind='mergesort')
+            ins, outs = firsts_all[m][order], np.maximum.accumulate(lasts_all[m][order])
+            breaks = np.flatnonzero(ins[1:] > outs[:-1] + 1) + 1
+            firsts, lasts = np.r_[0, breaks], np.r_[breaks - 1, len(ins) - 1]
+            ranges += [(self.producer_names[p], i, o) for i,o in zip(ins[firsts].tolist(), outs[lasts].tolist())]
+        return ranges
+
+
+
+class Timeline(object):
+    '''ordered collection of Tracks (by playlist id) sharing a single producer_names table'''
+    def __init__(self, tracks=None, producer_names=None):
+        self.tracks = tracks if tracks is not None else OrderedDict()
+        self.producer_names = producer_names if producer_names is not None else []
+        
+    @classmethod
+    def from_dicts(cls, track_dicts, special_keys=msa.mxml.default_special_keys, producers=None):
+        '''create from ordered dict of track_dicts (e.g. Project.tracks). producers : see Track.from_dict'''
+        producer_names = []
+        tracks = OrderedDict([(k, Track.from_dict(v, producer_names=producer_names, special_keys=special_keys, producers=producers)) for k,v in track_dicts.items()])
+        return cls(tracks, producer_names)
+    
+    def to_dicts(self, special_keys=msa.mxml.default_special_keys):
+        '''return ordered dict of track_dicts (same as Project.tracks)'''
+        return OrderedDict([(k, t.to_dict(special_keys=special_keys)) for k,t in self.tracks.items()])
+    
+    def get_names(self):
+        return [t.name for t in self.tracks.values()]
+    
+    def find_by_name(self, name, exact=True):
+        '''return list of tracks with name matching (or containing if not exact)'''
+        if exact: return [t for t in self.tracks.values() if t.name == name]
+        return [t for t in self.tracks.values() if t.name is not None and name in t.name]
+    
+    def __len__(self):
+        return len(self.tracks)
+    
+    def __iter__(self):
+        return iter(self.tracks.values())
+    
+    def __getitem__(self, k):
+        return self.tracks[k]
+    
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self.tracks.values())
+    
+
 '''
 Example kdenlive file:
 
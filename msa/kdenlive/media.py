@@ -0,0 +1,420 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Read and write media (numpy arrays and video files) frame by frame, so edits can be conformed
+without ever decoding or holding a whole video in memory.
+
+Usage:
+    src = msa.kdenlive.VideoReader('clip.mp4') # nothing decoded yet
+    src.plan([(i, o) for _, i, o in track.source_ranges()]) # optional, seek only between the ranges the track uses
+    view = msa.kdenlive.EditView(track, src)
+    msa.kdenlive.write_in_batches('out.mp4', view, 16, fps=src.fps) # only decodes frames used by the track
+
+    # or decode the next few batches on background threads while the current one is being written
+    msa.kdenlive.write_in_batches('out.mp4', view, 16, fps=src.fps, prefetch=4)
+
+    # or for tracks using many clips, open each producer's media when it's first needed
+    sources = msa.kdenlive.SourceRegistry(prj.producers, root_dir=prj.root_dir)
+    view = msa.kdenlive.EditView(track, sources)
+
+Video IO is via skvideo (pip install sk-video), which needs ffmpeg and ffprobe.
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import os
+import time
+import bisect
+import threading
+import numpy as np
+from collections import OrderedDict, deque
+try: from collections.abc import Mapping # python 3
+except ImportError: from collections import Mapping # python 2
+
+import msa.fileio
+import msa.data
+from msa.data import NpyWriter # also used by msa.data.save_npy_in_batches
+import msa.mxml
+from msa.kdenlive.kdenlive import KEY_RESOURCE, KEY_SERVICE, KEY_WARP_RESOURCE, element_properties
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+hot_logger = msa.logger.getHotLogger(__name__)
+
+VIDEO_EXTENSIONS = ['.mp4', '.mov']
+
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def native_path(path):
+    '''expand path and make sure it's a native str (skvideo fails with unicode paths on python 2, e.g. paths loaded from json)'''
+    path = msa.fileio.expand(path)
+    return path if isinstance(path, str) else path.encode('utf-8')
+
+
+def native_str(s):
+    '''return s as a native str, utf-8 encoded on python 2 (e.g. unicode track names from lxml, for printing or formatting into str)'''
+    if isinstance(s, str): return s
+    if type(s).__name__ == 'unicode': return s.encode('utf-8') # python 2
+    return str(s)
+
+
+def probe_video(path):
+    '''return (num_frames, height, width, fps) of first video stream in path'''
+    import skvideo.io # pip install sk-video.
+    info = skvideo.io.ffprobe(native_path(path))['video']
+    fps = info.get('@avg_frame_rate', info.get('@r_frame_rate', '25'))
+    fps = float(fps.split('/')[0]) / float(fps.split('/')[1]) if '/' in fps else float(fps)
+    if '@nb_frames' in info: num_frames = int(info['@nb_frames'])
+    else: num_frames = int(round(float(info['@duration']) * fps))
+    return num_frames, int(info['@height']), int(info['@width']), fps
+
+
+
+class VideoReader(object):
+    '''
+    random access to the frames of a video file, only decoding what's asked for.
+    frames asked for in order are decoded in one go, anything else seeks (restarts ffmpeg with -ss).
+    can be used as a source for conform_track_edit, EditView etc. (supports len, shape, dtype, indexing with ints, slices and index arrays)
+    indexing is thread safe (e.g. for PrefetchReader), but there's only one decoder, so reads from several threads take turns
+
+    max_skip : if the next frame asked for is up to this many frames ahead of the decoder, decode through instead of seeking
+        (0 means unused frames are never decoded)
+    see plan to decode through the gaps within source ranges known to be used (e.g. sped up clips) instead of seeking
+    '''
+    def __init__(self, path, max_skip=0):
+        self.path = native_path(path)
+        self.max_skip = max_skip
+        num_frames, height, width, self.fps = probe_video(self.path)
+        self.shape = (num_frames, height, width, 3)
+        self.dtype = np.dtype(np.uint8)
+        self.num_seeks = 0 # for stats
+        self.num_decoded = 0 # for stats
+        self._reader = None
+        self._frames = None
+        self._pos = 0 # index of next frame decoder will return
+        self._last = None # last decoded frame
+        self._plan_firsts, self._plan_lasts = [], [] # sorted, merged source ranges (inclusive), see plan
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        with self._lock, msa.logger.span('video.decode') as span:
+            x = self._getitem(key)
+            span.add_bytes(x.nbytes)
+            return x
+
+    def _getitem(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0: key += len(self)
+            if key < 0 or key >= len(self): raise IndexError('frame {} out of range for video with {} frames'.format(key, len(self)))
+            return self._frame(key)
+
+        idx = np.arange(*key.indices(len(self))) if isinstance(key, slice) else np.asarray(key)
+        idx = np.where(idx < 0, idx + len(self), idx)
+        if len(idx) and (idx.min() < 0 or idx.max() >= len(self)): raise IndexError('frame out of range for video with {} frames'.format(len(self)))
+        out = np.empty((len(idx), ) + self.shape[1:], dtype=self.dtype)
+        for j in np.argsort(idx, kind='mergesort').tolist(): out[j] = self._frame(idx[j]) # decode in source order
+        return out
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+    def read(self, start, count):
+        '''generator yielding count frames from start'''
+        for i in range(start, start + count): yield self[i]
+
+    def plan(self, ranges):
+        '''
+        tell the reader which source ranges will be read, list of (first, last) frames (inclusive, e.g. from Track.source_ranges)
+        jumping ahead within a range decodes through instead of seeking (restarting ffmpeg), jumps between ranges still seek
+        '''
+        firsts, lasts = [], []
+        for first, last in sorted(ranges):
+            if firsts and first <= lasts[-1] + 1: lasts[-1] = max(lasts[-1], last)
+            else: firsts, lasts = firsts + [first], lasts + [last]
+        with self._lock: self._plan_firsts, self._plan_lasts = firsts, lasts
+
+    def _planned(self, first, last):
+        '''True if source frames first to last are all in one planned range'''
+        r = bisect.bisect_right(self._plan_firsts, first) - 1
+        return r >= 0 and last <= self._plan_lasts[r]
+
+    def _frame(self, i):
+        if i == self._pos - 1 and self._last is not None: return self._last
+        if self._frames is None or i < self._pos or (i > self._pos + self.max_skip and not self._planned(self._pos, i)): self._seek(i)
+        while self._pos <= i:
+            self._last = next(self._frames)
+            self._pos += 1
+            self.num_decoded += 1
+        return self._last
+
+    def _seek(self, i):
+        import skvideo.io # pip install sk-video.
+        self.close()
+        hot_logger.debug('Seeking {} to frame {}', self.path, i, max_per_sec=10)
+        inputdict = {'-ss':'{:.6f}'.format(i / self.fps)} if i > 0 else {}
+        self._reader = skvideo.io.FFmpegReader(self.path, inputdict=inputdict, outputdict={'-vframes':str(len(self) - i)})
+        self._frames = self._reader.nextFrame()
+        self._pos = i
+        self.num_seeks += 1
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None: self._reader.close()
+            self._reader = self._frames = self._last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+class VideoWriter(object):
+    '''write frames to a video file in batches (via skvideo.io.FFmpegWriter)'''
+    def __init__(self, path, fps=25, outputdict=None):
+        import skvideo.io # pip install sk-video.
+        self.path = native_path(path)
+        msa.fileio.create_dir_for_file(self.path)
+        outputdict = dict({'-r':str(fps)}, **(outputdict or {}))
+        self._writer = skvideo.io.FFmpegWriter(self.path, inputdict={'-r':str(fps)}, outputdict=outputdict)
+        self.pos = 0
+
+    def write(self, frames):
+        with msa.logger.span('write.video') as span:
+            for f in frames: self._writer.writeFrame(f)
+            span.add_bytes(frames.nbytes)
+        self.pos += len(frames)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+def open_writer(path, shape, dtype, fps=25):
+    '''return NpyWriter or VideoWriter depending on extension of path'''
+    if is_video(path): return VideoWriter(path, fps=fps)
+    return NpyWriter(path, shape, dtype)
+
+
+def write_in_batches(path, X, batch_size, fps=25, show_progress=False, prefetch=0, prefetch_workers=1):
+    '''write indexable X (e.g. EditView) to npy or video (depending on extension of path), batch_size frames at a time
+    so only batch_size frames are ever in memory. returns the memmap if writing npy
+    prefetch : if > 0, read up to this many batches ahead on background threads while writing (see PrefetchReader)
+    prefetch_workers : number of threads reading ahead
+    '''
+    writer = open_writer(path, X.shape, X.dtype, fps=fps)
+    if prefetch > 0:
+        batches = PrefetchReader(X, batch_size, depth=prefetch, num_workers=prefetch_workers)
+        if show_progress:
+            from tqdm import tqdm # pip install tqdm
+            batches = tqdm(batches, desc=os.path.basename(path))
+    else:
+        batches = msa.data.iterate_in_batches(X, batch_size, show_progress=show_progress, progress_desc=os.path.basename(path))
+    for x in batches:
+        writer.write(x)
+    return writer.close()
+
+
+
+class PrefetchReader(object):
+    '''
+    iterate over X (e.g. EditView) in batches, reading the next batches on a pool of background threads
+    while the consumer is busy with the current one, so source IO / decoding overlaps with whatever is done with each batch
+    (e.g. writing it to disk). Batches are yielded in order, and at most depth batches are read ahead (on top of the one being consumed)
+    so memory is bounded by (depth + 1) * batch_size frames. Errors raised reading a batch are re-raised when it's reached.
+
+    X : indexable (time on 0th axis) supporting slicing, e.g. EditView (which looks up its sources from the track's clip table)
+    batch_size : number of frames per batch
+    depth : maximum number of batches to read ahead
+    num_workers : number of threads reading batches. more than one only helps if the source can read in parallel
+        (e.g. memmaps on network filesystems, or a SourceRegistry of npy files). limited to 1 if X reads from video (see _reads_video):
+        a VideoReader decodes sequentially, so threads reading different batches from it would make it seek back and forth
+    start, stop : range of frames to read (default all)
+
+    after iterating, wait_time is the total seconds the consumer spent blocked waiting for batches (near 0 means IO was fully hidden)
+    and read_time the total seconds spent reading them on the workers
+    '''
+    def __init__(self, X, batch_size, depth=2, num_workers=1, start=0, stop=None):
+        self.X = X
+        self.batch_size = batch_size
+        self.depth = max(depth, 1)
+        self.num_workers = max(num_workers, 1)
+        if self.num_workers > 1 and _reads_video(X):
+            logger.info('Prefetching with 1 thread instead of {}, as video sources decode sequentially'.format(self.num_workers))
+            self.num_workers = 1
+        self.start = start
+        self.stop = len(X) if stop is None else min(stop, len(X))
+        self.wait_time = 0
+        self.read_time = 0
+        self.num_batches = 0
+
+    def __len__(self):
+        return (max(self.stop - self.start, 0) + self.batch_size - 1) // self.batch_size
+
+    def _read(self, i):
+        t = time.time()
+        x = self.X[i:min(i + self.batch_size, self.stop)]
+        return x, time.time() - t
+
+    def __iter__(self):
+        self.wait_time = self.read_time = 0
+        self.num_batches = 0
+        starts = iter(range(self.start, self.stop, self.batch_size))
+        pending = deque()
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.num_workers)
+
+        def submit():
+            i = next(starts, None)
+            if i is not None: pending.append(pool.apply_async(self._read, (i, )))
+
+        try:
+            for _ in range(self.depth): submit()
+            while pending:
+                t = time.time()
+                x, read_time = pending.popleft().get()
+                self.wait_time += time.time() - t
+                self.read_time += read_time
+                self.num_batches += 1
+                submit()
+                yield x
+        finally:
+            pool.close() # let batches already being read finish, so the source isn't closed under them
+            pool.join()
+            logger.debug('Prefetched {} batches of {} frames, reading took {:.3f}s, consumer waited {:.3f}s'.format(self.num_batches, self.batch_size, self.read_time, self.wait_time))
+
+
+def _reads_video(X):
+    '''True if reading X decodes video, i.e. X is a VideoReader, or X.source (e.g. EditView) is or contains one (or a video path in a SourceRegistry)'''
+    if isinstance(X, VideoReader): return True
+    source = getattr(X, 'source', None)
+    if isinstance(source, VideoReader): return True
+    if isinstance(source, SourceRegistry): return any(is_video(p) for p in source.paths.values() if p)
+    if isinstance(source, dict): return any(isinstance(s, VideoReader) for s in source.values())
+    return False
+
+
+
+def open_source(path, mmap_mode='r'):
+    '''open path as indexable source without loading it, npy as memmap (if mmap_mode), videos as VideoReader'''
+    path = msa.fileio.expand(path)
+    if is_video(path): return VideoReader(path)
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+
+class SourceRegistry(Mapping):
+    '''
+    dict-like {producer id : source} for conform_track_edit, EditView etc. built from Project.producers
+    each producer's resource property is resolved to a path up front (cheap), but sources are only opened
+    the first time a clip needs them (see open_source), and at most max_open are kept open (least recently used are closed)
+    producers using the same file (e.g. speed changes of a clip) share one open source. producers with no file (e.g. color clips)
+    are left out, so gather_frames fills their clips with empty_value
+
+    producers : ordered dict of producer dicts (e.g. Project.producers)
+    root_dir : folder relative resources are relative to (e.g. Project.root_dir)
+    search_dirs : other folders to look for resources in (if not found in root_dir, e.g. if media has moved)
+    ext : if given, replace extension of resources with this (e.g. '.npy' to conform z-sequences saved alongside the videos used in the edit)
+    paths : dict {producer id : path} to override resolved paths
+    '''
+    def __init__(self, producers, root_dir='', search_dirs=[], ext=None, paths=None, max_open=16, mmap_mode='r', special_keys=msa.mxml.default_special_keys):
+        self.max_open = max_open
+        self.mmap_mode = mmap_mode
+        self.paths = OrderedDict()
+        for k, producer in producers.items():
+            props = element_properties(producer, special_keys=special_keys)
+            resource = props.get(KEY_RESOURCE)
+            if props.get(KEY_SERVICE) == 'timewarp': # speed changes read the original media
+                resource = props.get(KEY_WARP_RESOURCE) or (resource.split(':', 1)[-1] if resource else None)
+            if not resource or props.get(KEY_SERVICE) in ['color', 'colour']: continue
+            self.paths[k] = resolve_path(resource, [root_dir] + list(search_dirs), ext=ext)
+        if paths: self.paths.update(paths)
+        self._open = OrderedDict() # {path : open source}, least recently used first
+        self._lock = threading.Lock()
+        self.num_opened = 0 # for stats
+
+    def __getitem__(self, k):
+        path = self.paths[k]
+        with self._lock:
+            if path in self._open:
+                src = self._open.pop(path)
+            else:
+                hot_logger.debug('Opening {} for producer {}', path, k, max_per_sec=10)
+                src = open_source(path, mmap_mode=self.mmap_mode)
+                self.num_opened += 1
+            self._open[path] = src
+            while len(self._open) > self.max_open: self._close(next(iter(self._open)))
+            return src
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, k):
+        return k in self.paths
+
+    def is_open(self, k):
+        return self.paths.get(k) in self._open
+
+    def _close(self, path):
+        src = self._open.pop(path)
+        if hasattr(src, 'close'): src.close()
+        hot_logger.debug('Closed {}', path, max_per_sec=10)
+
+    def close(self):
+        with self._lock:
+            for k in list(self._open.keys()): self._close(k)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+def resolve_path(resource, search_dirs, ext=None):
+    '''return path to resource, looking in search_dirs if it's relative or doesn't exist (falls back to first guess if not found)
+    if ext is given replace the extension of resource with it
+    '''
+    resource = msa.fileio.expand(resource)
+    if ext: resource = os.path.splitext(resource)[0] + ext
+    candidates = [resource] if os.path.isabs(resource) else []
+    for d in search_dirs:
+        candidates += [msa.fileio.join(d, resource), msa.fileio.join(d, os.path.basename(resource))]
+    candidates = candidates or [resource]
+    for p in candidates:
+        if os.path.exists(p): return p
+    return candidates[0]
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Dissolves between tracks of a tractor, rendered as blends of the overlapping sources:
+linear or spherical interpolation for z-sequences, alpha blending for video frames.
+Each transition is blended with one batched numpy op over all its frames (per batch when streaming).
+
+Usage:
+    prj = msa.kdenlive.Project(path)
+    transitions = msa.kdenlive.get_transitions(prj)
+    view = msa.kdenlive.EditView(prj.composite(), src, transitions=transitions, blend='slerp')
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import numpy as np
+
+import msa.mxml
+from msa.kdenlive.kdenlive import KEY_CHILDREN, KEY_HIDE, KEY_IN, KEY_OUT, KEY_PRODUCER, KEY_SERVICE, KEY_TRACK, composite_tracks, element_properties, gather_frames
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+
+KEY_TRANSITION = 'transition'
+DISSOLVE_SERVICES = ['luma', 'dissolve'] # other transitions (e.g. composite, qtblend) are overlays, i.e. top track wins
+BLEND_MODES = ['lerp', 'slerp']
+
+
+class Transition(object):
+    '''
+    dissolve from track a to track b over timeline frames start to stop (exclusive)
+    at each frame b is mixed in with weight (frame - start) / (stop - start) (or 1 minus that if reverse), same as mlt's luma
+    a, b : Tracks (sharing producer_names)
+    above : Tracks stacked above b. the dissolve is hidden wherever any of them isn't blank
+    '''
+    def __init__(self, a, b, start, stop, reverse=False, id=None, above=None):
+        self.a, self.b = a, b
+        self.above = above or []
+        self.start, self.stop = start, stop
+        self.reverse = reverse
+        self.id = id
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def alpha(self, frames):
+        '''weight of b at timeline frames (int array)'''
+        alpha = (np.asarray(frames) - self.start) / float(len(self))
+        return 1 - alpha if self.reverse else alpha
+
+    def __repr__(self):
+        return 'Transition({}, {} -> {}, {}-{}{})'.format(self.id, self.a.name, self.b.name, self.start, self.stop, ', reverse' if self.reverse else '')
+
+
+
+def get_transitions(prj, tractor_id=None, special_keys=msa.mxml.default_special_keys):
+    '''
+    return list of Transitions (dissolves) in tractor_id of Project prj (default the main tractor, i.e. the last one)
+    transitions which aren't dissolves, are always active (i.e. kdenlive's internal track compositing), or aren't between two tracks are skipped
+    if there are tracks between a and b, a is composited with them on top (see composite_tracks), as that's what b dissolves from
+    '''
+    if tractor_id is None:
+        if not prj.tractors: raise KeyError('No tractor in {}'.format(prj.path))
+        tractor_id = next(reversed(prj.tractors))
+    tag_key, children_key = special_keys['tag'], special_keys[KEY_CHILDREN]
+    children = prj.tractors[tractor_id].get(children_key, [])
+
+    # transitions refer to tracks by index in the tractor (including black_track etc.)
+    tracks, hidden = [], []
+    for c in children:
+        if c.get(tag_key) != KEY_TRACK: continue
+        k = c.get(KEY_PRODUCER)
+        if k in prj.tractors: tracks.append(prj.composite(k))
+        else: tracks.append(prj.timeline.tracks.get(k))
+        hidden.append(c.get(KEY_HIDE) in ['video', 'both'])
+
+    transitions = []
+    for c in children:
+        if c.get(tag_key) != KEY_TRANSITION: continue
+        props = element_properties(c, special_keys=special_keys)
+        if props.get(KEY_SERVICE) not in DISSOLVE_SERVICES or props.get('always_active') == '1' or KEY_IN not in c: continue
+        ia, ib = [int(props.get(k, -1)) for k in ['a_track', 'b_track']]
+        a, b = [tracks[i] if 0 <= i < len(tracks) else None for i in [ia, ib]]
+        if a is None or b is None:
+            logger.debug('Skipping transition {}, not between two tracks'.format(c.get('id')))
+            continue
+        between = [t for t, h in zip(tracks[ia+1:ib], hidden[ia+1:ib]) if t is not None and not h]
+        if between:
+            logger.debug('Transition {} spans {} tracks between {} and {}, compositing them onto {}'.format(c.get('id'), len(between), ia, ib, ia))
+            a = composite_tracks([a] + between, producer_names=a.producer_names)
+        above = [t for t, h in zip(tracks[ib+1:], hidden[ib+1:]) if t is not None and not h]
+        transitions.append(Transition(a, b, int(c[KEY_IN]), int(c[KEY_OUT]) + 1, reverse=props.get('reverse') == '1', id=c.get('id'), above=above))
+    return transitions
+
+
+
+def lerp(a, b, t):
+    '''linear interpolation between batches a and b (time on 0th axis), t : weight of b for each item'''
+    t = np.reshape(t, (-1, ) + (1, ) * (np.ndim(a) - 1))
+    return a + (b - a) * t
+
+
+def slerp(a, b, t, eps=1e-7):
+    '''spherical interpolation between batches of vectors a and b (time on 0th axis, flattened after that), t : weight of b for each item
+    falls back to lerp where a and b are (nearly) parallel
+    '''
+    shape = np.shape(a)
+    a, b = np.reshape(a, (len(a), -1)), np.reshape(b, (len(b), -1))
+    t = np.reshape(t, (-1, 1))
+    dot = np.sum(a * b, axis=1, keepdims=True) / np.maximum(np.linalg.norm(a, axis=1, keepdims=True) * np.linalg.norm(b, axis=1, keepdims=True), eps)
+    omega = np.arccos(np.clip(dot, -1, 1))
+    so = np.sin(omega)
+    parallel = so < eps
+    so[parallel] = 1 # avoid division by zero, these are replaced with lerp
+    out = np.sin((1 - t) * omega) / so * a + np.sin(t * omega) / so * b
+    if parallel.any():
+        rows = parallel[:,0]
+        out[rows] = lerp(a[rows], b[rows], t[rows])
+    return out.reshape(shape)
+
+
+def blend_frames(a, b, t, blend='lerp'):
+    '''
+    blend batches of frames a and b (weight of b is t) with blend ('lerp' or 'slerp'), returning the same dtype as a
+    integer frames (e.g. video) are always alpha blended (i.e. lerp, then rounded)
+    '''
+    if blend not in BLEND_MODES: raise ValueError('Unknown blend mode "{}", should be one of {}'.format(blend, BLEND_MODES))
+    if np.issubdtype(a.dtype, np.integer):
+        out = lerp(a.astype(np.float32), b.astype(np.float32), t)
+        info = np.iinfo(a.dtype)
+        return np.clip(np.round(out), info.min, info.max).astype(a.dtype)
+    fn = slerp if blend == 'slerp' else lerp
+    return fn(a, b, t).astype(a.dtype, copy=False)
+
+
+def apply_transitions(out, idx, transitions, source, blend='lerp'):
+    '''
+    overwrite out (frames gathered for timeline frames idx, e.g. by gather_frames) with the blends of any transitions at idx
+    frames where either track of a transition is blank, or a track above it isn't, are left as they are
+    source : as for gather_frames
+    '''
+    for tr in transitions:
+        sel = np.flatnonzero((idx >= tr.start) & (idx < tr.stop))
+        if not len(sel): continue
+        frames = idx[sel]
+        (pa, fa), (pb, fb) = tr.a.lookup(frames), tr.b.lookup(frames)
+        visible = (fa >= 0) & (fb >= 0)
+        for t in tr.above: visible &= t.lookup(frames)[0] < 0
+        valid = np.flatnonzero(visible)
+        if not len(valid): continue
+        a = gather_frames(source, pa[valid], fa[valid], producer_names=tr.a.producer_names)
+        b = gather_frames(source, pb[valid], fb[valid], producer_names=tr.b.producer_names)
+        out[sel[valid]] = blend_frames(a, b, tr.alpha(frames[valid]), blend=blend)
+    return out
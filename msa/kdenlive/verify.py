@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Check a conformed edit against a ground truth chunk by chunk, with errors broken down per clip.
+Only one chunk of each (plus a few numbers per clip) is in memory at a time, so both can be memmapped npys,
+VideoReaders or EditViews of any length.
+
+Usage:
+    edited, ref = np.load('out.npy', mmap_mode='r'), np.load('z_edited.npy', mmap_mode='r')
+    report = msa.kdenlive.verify_edit(edited, ref, track, chunk_size=1024, stop_at_first_failure=True)
+    msa.kdenlive.print_verify_report(report)
+"""
+
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import numpy as np
+
+import msa.mxml
+from msa.kdenlive.kdenlive import Track
+
+import msa.logger
+logger = msa.logger.getLogger(__name__)
+
+
+def verify_edit(edited, ref, track=None, chunk_size=256, tolerance=0, stop_at_first_failure=False, special_keys=msa.mxml.default_special_keys):
+    '''
+    compare edited to ref (e.g. ground truth) chunk_size frames at a time, returns report dict with
+        ok : True if shapes match and no frame is off by more than tolerance
+        frames : number of frames compared, stopped : True if stopped early (at the first failing chunk)
+        max_error, mean_error : max and mean absolute error over all values compared
+        norm : L2 norm of the difference (np.linalg.norm(ref - edited) if all frames were compared)
+        first_mismatch : first frame off by more than tolerance (None if there aren't any)
+        clips : list of dicts per row of track (entries and blanks, or one for everything if no track) with
+            index, producer (None for blanks), start, length, frames (compared), max_error, mean_error, first_mismatch
+    edited, ref : indexable with slices (ndarray, memmap, VideoReader, EditView etc.), time on 0th axis
+    track : Track or track_dict that edited is a conform of, for the per clip breakdown
+    tolerance : maximum absolute error allowed per value (e.g. for lossy video)
+    stop_at_first_failure : if True, stop after the first chunk with a mismatch
+    '''
+    if track is not None and not isinstance(track, Track): track = Track.from_dict(track, special_keys=special_keys)
+    if tuple(edited.shape[1:]) != tuple(ref.shape[1:]): raise ValueError('frame shapes differ: edit {} vs reference {}'.format(edited.shape[1:], ref.shape[1:]))
+    num_frames = min(len(edited), len(ref))
+    frame_size = int(np.prod(edited.shape[1:]))
+
+    if track is not None: starts, lengths = track.starts.astype(np.intp), track.lengths.astype(np.intp)
+    else: starts, lengths = np.zeros(1, dtype=np.intp), np.array([num_frames], dtype=np.intp)
+    num_rows = len(starts)
+    row_max, row_sum, row_frames = np.zeros(num_rows), np.zeros(num_rows), np.zeros(num_rows, dtype=np.intp)
+    row_first = np.full(num_rows, -1, dtype=np.intp)
+
+    buf = np.empty((min(chunk_size, num_frames), frame_size), dtype=np.float64) # differences of a chunk
+    total_sq, total_sum, total_max, first_mismatch, frames = 0., 0., 0., None, 0
+    with msa.logger.span('verify') as span:
+        for i in range(0, num_frames, chunk_size):
+            n = min(chunk_size, num_frames - i)
+            a, b = np.asarray(edited[i:i+n]), np.asarray(ref[i:i+n])
+            span.add_bytes(a.nbytes + b.nbytes)
+            if np.array_equal(a, b): # usual case, one cheap pass
+                frame_max = frame_sum = np.zeros(n)
+            else:
+                d = buf[:n]
+                np.subtract(a.reshape(n, -1), b.reshape(n, -1), out=d, dtype=np.float64)
+                total_sq += np.einsum('ij,ij->', d, d)
+                np.abs(d, out=d)
+                frame_max, frame_sum = d.max(axis=1), d.sum(axis=1)
+                total_sum, total_max = total_sum + frame_sum.sum(), max(total_max, frame_max.max())
+
+            t = np.arange(i, i + n)
+            rows = np.searchsorted(starts, t, side='right') - 1
+            valid = (rows >= 0) & (t < starts[-1] + lengths[-1] if num_rows else False) # frames past the end of the track aren't in a clip
+            r, fm = rows[valid], frame_max[valid]
+            np.maximum.at(row_max, r, fm)
+            row_sum += np.bincount(r, weights=frame_sum[valid], minlength=num_rows)
+            row_frames += np.bincount(r, minlength=num_rows)
+
+            bad = np.flatnonzero(frame_max > tolerance)
+            frames += n
+            if len(bad):
+                if first_mismatch is None: first_mismatch = i + int(bad[0])
+                bad = bad[valid[bad]]
+                for row, f in zip(rows[bad].tolist(), t[bad].tolist()): # in order, so the first seen is the first per row
+                    if row_first[row] < 0: row_first[row] = f
+                if stop_at_first_failure: break
+
+    num_values = frames * frame_size
+    clips = []
+    for k in range(num_rows):
+        producer = None
+        if track is not None and track.producers[k] >= 0: producer = track.producer_names[track.producers[k]]
+        clips.append(dict(index=k, producer=producer, start=int(starts[k]), length=int(lengths[k]), frames=int(row_frames[k]),
+                          max_error=float(row_max[k]), mean_error=float(row_sum[k] / (row_frames[k] * frame_size)) if row_frames[k] else 0.,
+                          first_mismatch=int(row_first[k]) if row_first[k] >= 0 else None))
+
+    length_ok = len(edited) == len(ref) and (track is None or track.length == len(ref))
+    report = dict(ok=length_ok and first_mismatch is None, frames=frames, stopped=frames < num_frames,
+                  edit_length=len(edited), ref_length=len(ref), track_length=track.length if track is not None else None,
+                  tolerance=tolerance, max_error=float(total_max), mean_error=float(total_sum / num_values) if num_values else 0.,
+                  norm=float(np.sqrt(total_sq)), first_mismatch=first_mismatch, clips=clips)
+    logger.debug('Verified {} frames, max error {}, first mismatch {}'.format(frames, total_max, first_mismatch))
+    return report
+
+
+
+def print_verify_report(report, all_clips=False, max_clips=20):
+    '''print table of clips with errors (or all clips if all_clips, up to max_clips rows, 0 for no limit) and a summary line'''
+    clips = [c for c in report['clips'] if all_clips or c['first_mismatch'] is not None]
+    if clips:
+        print('{:>8} {:<24} {:>10} {:>8} {:>12} {:>12} {:>14}'.format('clip', 'producer', 'start', 'length', 'max error', 'mean error', 'first mismatch'))
+        for c in clips[:max_clips or None]:
+            first = '-' if c['first_mismatch'] is None else c['first_mismatch']
+            producer = '-' if report['track_length'] is None else c['producer'] or 'blank'
+            print('{:>8} {:<24} {:>10} {:>8} {:>12.6g} {:>12.6g} {:>14}'.format(c['index'], str(producer)[:24], c['start'], c['length'], c['max_error'], c['mean_error'], first))
+        if max_clips and len(clips) > max_clips: print('... and {} more clips'.format(len(clips) - max_clips))
+
+    if report['edit_length'] != report['ref_length'] or report['track_length'] not in (None, report['ref_length']):
+        print('Length mismatch: edit has {} frames, reference {}, track {}'.format(report['edit_length'], report['ref_length'], report['track_length']))
+    num_bad = sum(1 for c in report['clips'] if c['first_mismatch'] is not None)
+    print('{}: compared {} frames{}, {} of {} clips differ (tolerance {}). max error {:.6g}, mean error {:.6g}{}'.format(
+          'OK' if report['ok'] else 'FAILED', report['frames'], ' (stopped at first failure)' if report['stopped'] else '', num_bad, len(report['clips']),
+          report['tolerance'], report['max_error'], report['mean_error'], '' if report['first_mismatch'] is None else ', first mismatch at frame {}'.format(report['first_mismatch'])))
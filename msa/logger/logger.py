@@ -25,11 +25,20 @@ Usage:
     logger.error(msg)
     etc.
 
+    # in hot paths (per clip, per chunk etc.), nothing is formatted unless the level is enabled
+    hot_logger = msa.logger.getHotLogger(__name__)
+    debug = hot_logger.is_enabled(logging.DEBUG) # check once outside the loop
+    for i in ...:
+        if debug: hot_logger.debug('Applying clip {}', i, frames=n, every=100) # every 100th call, with frames=n appended
+
 """
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
 
+import sys
+import time
 import logging
 logging.basicConfig(level=logging.INFO, 
 #                    datefmt='%m/%d/%Y %H:%M:%S',
@@ -40,6 +49,70 @@ logging.basicConfig(level=logging.INFO,
 def getLogger(name):
     return logging.getLogger(name)
 
+
+def getHotLogger(name):
+    return HotLogger(logging.getLogger(name))
+
+
+
+class _LazyMessage(object):
+    '''msg.format(*args) followed by key=value fields, only formatted when a handler actually needs the string'''
+    __slots__ = ['msg', 'args', 'fields']
+    def __init__(self, msg, args, fields):
+        self.msg, self.args, self.fields = msg, args, fields
+
+    def __str__(self):
+        s = self.msg.format(*self.args) if self.args else self.msg
+        if self.fields: s += ' | ' + ' '.join('{}={}'.format(k, self.fields[k]) for k in sorted(self.fields))
+        return s
+
+
+
+class HotLogger(object):
+    '''
+    wraps a logging.Logger for hot paths. messages use str.format style args and are only formatted if
+    the level is enabled and a handler emits them. keyword args are structured fields, appended as key=value
+    (and also set as record.fields for handlers which want them as a dict).
+    every : only log every nth call with this message template (the 1st, n+1th etc.)
+    max_per_sec : log at most this many calls per second with this message template
+    calls dropped by every / max_per_sec are counted and reported as the suppressed field on the next one logged
+    for no cost at all when disabled, check is_enabled once outside the loop, and only call inside it if it's True
+    '''
+    def __init__(self, logger):
+        self.logger = logger
+        self._limits = {} # {msg : [calls since last logged, time last logged]}
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args, **fields):
+        self._log(level, msg, args, fields)
+
+    def debug(self, msg, *args, **fields):
+        self._log(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        self._log(logging.INFO, msg, args, fields)
+
+    def warning(self, msg, *args, **fields):
+        self._log(logging.WARNING, msg, args, fields)
+
+    def _log(self, level, msg, args, fields):
+        if not self.logger.isEnabledFor(level): return
+        every, max_per_sec = fields.pop('every', None), fields.pop('max_per_sec', None)
+        if every or max_per_sec:
+            state = self._limits.setdefault(msg, [0, 0])
+            state[0] += 1
+            now = time.time()
+            if state[1] and ((every and state[0] < every) or (max_per_sec and now - state[1] < 1. / max_per_sec)): return
+            if state[0] > 1: fields['suppressed'] = state[0] - 1
+            state[0], state[1] = 0, now
+        f = sys._getframe(2) # report the caller of debug, info etc. not this function
+        record = self.logger.makeRecord(self.logger.name, level, f.f_code.co_filename, f.f_lineno, _LazyMessage(msg, args, fields), (), None, f.f_code.co_name)
+        record.fields = fields
+        self.logger.handle(record)
+
+
 logger = getLogger(__name__)
 
 def test_levels():
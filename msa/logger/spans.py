@@ -0,0 +1,211 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Timing spans for finding out where time goes: each span records wall time, cpu time (of the process),
+peak rss and bytes moved (if told). Spans nest, and can be printed as a summary table or saved as a
+chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+Disabled by default, in which case span() returns a shared no-op and costs one flag check.
+
+Usage:
+    msa.logger.enable_spans() # or set environment variable MSA_SPANS=1
+
+    with msa.logger.span('conform') as s:
+        out = conform(...)
+        s.add_bytes(out.nbytes)
+
+    @msa.logger.timed('load')
+    def load(path): ...
+
+    msa.logger.print_span_summary()
+    msa.logger.save_chrome_trace('trace.json')
+"""
+from __future__ import absolute_import, division, print_function
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
+
+import os
+import sys
+import threading
+import functools
+from timeit import default_timer as timer
+from collections import OrderedDict
+try: import resource # not on windows
+except ImportError: resource = None
+
+# msa.logger does from spans import *, so only export these (not os, threading etc.)
+__all__ = ['span', 'timed', 'Span', 'enable_spans', 'disable_spans', 'spans_enabled', 'get_spans', 'clear_spans',
+           'cpu_time', 'peak_rss', 'span_summary', 'print_span_summary', 'save_chrome_trace']
+
+
+_enabled = bool(os.environ.get('MSA_SPANS'))
+_spans = [] # finished Spans, in order of finishing
+_local = threading.local() # stack of open spans per thread
+_t0 = timer()
+
+
+def enable_spans(enabled=True):
+    '''turn recording of spans on (or off)'''
+    global _enabled
+    _enabled = enabled
+
+
+def disable_spans():
+    enable_spans(False)
+
+
+def spans_enabled():
+    return _enabled
+
+
+def get_spans():
+    '''return list of finished Spans'''
+    return list(_spans)
+
+
+def clear_spans():
+    del _spans[:]
+
+
+def cpu_time():
+    '''user + system cpu time of the process in seconds'''
+    t = os.times()
+    return t[0] + t[1]
+
+
+def peak_rss():
+    '''peak resident set size of the process in bytes (None if unknown)'''
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024 # kilobytes on linux
+
+
+
+class Span(object):
+    '''
+    one timed stage. use via span()
+    wall, cpu : seconds. start : seconds since spans module was loaded
+    peak_rss : peak rss of the process (bytes) when the span ended, rss_growth : how much the peak grew during the span
+    bytes : bytes moved (added with add_bytes), depth : nesting depth in its thread
+    '''
+    def __init__(self, name, args=None):
+        self.name = name
+        self.args = args or {}
+        self.bytes = 0
+        self.tid = threading.current_thread().ident
+        self.depth = 0
+        self.start = self.wall = self.cpu = 0
+        self.peak_rss = self.rss_growth = None
+
+    def add_bytes(self, n):
+        self.bytes += int(n)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self.depth = len(stack)
+        stack.append(self)
+        self._rss = peak_rss()
+        self._cpu = cpu_time()
+        self.start = timer() - _t0
+        return self
+
+    def __exit__(self, *args):
+        self.wall = timer() - _t0 - self.start
+        self.cpu = cpu_time() - self._cpu
+        self.peak_rss = peak_rss()
+        if self.peak_rss is not None: self.rss_growth = self.peak_rss - self._rss
+        _local.stack.pop()
+        _spans.append(self)
+
+    def __repr__(self):
+        return 'Span({}, wall={:.6f}, cpu={:.6f}, bytes={})'.format(self.name, self.wall, self.cpu, self.bytes)
+
+
+
+class _NullSpan(object):
+    '''what span() returns when disabled'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def add_bytes(self, n):
+        pass
+
+_null_span = _NullSpan()
+
+
+def span(name, **args):
+    '''context manager timing a stage called name (args are saved with it, e.g. for the chrome trace). yields the Span (see add_bytes)'''
+    if not _enabled: return _null_span
+    return Span(name, args)
+
+
+def timed(name=None):
+    '''decorator timing every call of a function with span (name defaults to module.function)'''
+    def decorator(fn):
+        span_name = name or '{}.{}'.format(fn.__module__, fn.__name__)
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled: return fn(*args, **kwargs)
+            with Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+def span_summary(spans=None):
+    '''return list of OrderedDicts, one per span name (in order of first start) with count, wall, cpu, bytes, max peak_rss and max rss_growth'''
+    spans = _spans if spans is None else spans
+    rows = OrderedDict()
+    for s in sorted(spans, key=lambda s: s.start):
+        r = rows.get(s.name)
+        if r is None:
+            r = rows[s.name] = OrderedDict([('name', s.name), ('depth', s.depth), ('count', 0), ('wall', 0), ('cpu', 0), ('bytes', 0), ('peak_rss', None), ('rss_growth', None)])
+        r['count'] += 1
+        r['wall'] += s.wall
+        r['cpu'] += s.cpu
+        r['bytes'] += s.bytes
+        if s.peak_rss is not None:
+            r['peak_rss'] = max(r['peak_rss'] or 0, s.peak_rss)
+            r['rss_growth'] = max(r['rss_growth'] or 0, s.rss_growth)
+    return list(rows.values())
+
+
+def print_span_summary(spans=None, file=None):
+    '''print table of span_summary (nested spans are indented under the first span they were seen in)'''
+    mb = lambda x: '{:.1f}'.format(x / 1e6) if x is not None else '-'
+    print('{:<40} {:>7} {:>10} {:>10} {:>10} {:>9} {:>10} {:>10}'.format('span', 'count', 'wall (s)', 'cpu (s)', 'MB moved', 'GB/s', 'peak MB', '+peak MB'), file=file)
+    for r in span_summary(spans):
+        gbs = r['bytes'] / r['wall'] / 1e9 if r['bytes'] and r['wall'] else 0
+        name = ('  ' * r['depth'] + r['name'])[:40]
+        print('{:<40} {:>7} {:>10.4f} {:>10.4f} {:>10} {:>9.2f} {:>10} {:>10}'.format(name, r['count'], r['wall'], r['cpu'], mb(r['bytes']), gbs, mb(r['peak_rss']), mb(r['rss_growth'])), file=file)
+
+
+def save_chrome_trace(path, spans=None):
+    '''save spans as chrome trace event json (complete events, one row per thread)'''
+    import json
+    spans = _spans if spans is None else spans
+    pid = os.getpid()
+    events = []
+    for s in spans:
+        args = dict(s.args, cpu=s.cpu, bytes=s.bytes, peak_rss=s.peak_rss, rss_growth=s.rss_growth)
+        events.append(dict(name=s.name, cat=s.name.split('.')[0], ph='X', ts=s.start * 1e6, dur=s.wall * 1e6, pid=pid, tid=s.tid, args=args))
+    path = os.path.expanduser(os.path.expandvars(path))
+    with open(path, 'w') as f: json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
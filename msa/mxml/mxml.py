@@ -18,8 +18,10 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
+import gc
 from lxml import etree
 from collections import OrderedDict
 
@@ -28,24 +30,79 @@ import msa.utils
 # save tag, children and value under these keys
 default_special_keys = dict(tag='TAG', children='CHILDREN', value='VALUE')
 
-def e_to_dict(xml_element, add_empty=False, special_keys=default_special_keys):
+def e_to_dict(xml_element, add_empty=False, special_keys=default_special_keys, include_tags=None):
     '''convert an xml element to dictionary
     preserves order of all tags, even if mixed up etc (unlike most examples online)
     explodes attributes into root of dict (potentially dangerous, if there is an attribute with same name as special keys)
+    include_tags : if given, only descendants with these tags are converted (and the rest skipped, with their subtrees), e.g. to skip filters in big documents
+    iterative (not recursive), so very deep documents are fine too
     '''
     tag_key, children_key, value_key = special_keys['tag'], special_keys['children'], special_keys['value']
+    special = set([tag_key, children_key, value_key])
     if type(xml_element) != etree._Element: return xml_element
-    assert(msa.utils.find_key(xml_element.attrib, special_keys.values()) is None) # make sure keys aren't in attrib
-    d = { tag_key:xml_element.tag }
-    if add_empty or len(xml_element) > 0: d[children_key] = [e_to_dict(c) for c in xml_element]
-    if add_empty or xml_element.text: d[value_key] = xml_element.text
-    d.update(**xml_element.attrib)
-    return d
+    if include_tags is not None: include_tags = set(include_tags)
+    Element = etree._Element
+
+    root = {}
+    stack = [(xml_element, root)]
+    gc_enabled = gc.isenabled()
+    gc.disable() # building lots of small dicts triggers lots of pointless gc passes
+    try:
+        while stack:
+            e, d = stack.pop()
+            d[tag_key] = e.tag
+            if add_empty or len(e) > 0:
+                children = d[children_key] = []
+                for c in e:
+                    if type(c) != Element:
+                        if include_tags is None: children.append(c)
+                    elif include_tags is None or c.tag in include_tags:
+                        cd = {}
+                        children.append(cd)
+                        stack.append((c, cd))
+            text = e.text
+            if add_empty or text: d[value_key] = text
+            attrib = e.attrib
+            if attrib:
+                assert(special.isdisjoint(attrib)) # make sure special keys aren't in attrib
+                d.update(attrib)
+    finally:
+        if gc_enabled: gc.enable()
+    return root
 
-def children_by_key(xml_element, tag, keys=['id', 'name'], **kwargs):
+def children_by_key(xml_element, tag, keys=['id', 'name'], filter_fn=None, **kwargs):
     '''find all children with denoted tag, and create ordered dict
     where attribute denoted by 'key' is used as key
     if 'key' is list or tuple, search attributes in order of list
+    if filter_fn is given, only children for which filter_fn(tag, key, element) is True are converted
     '''
-    return OrderedDict([(x.attrib[msa.utils.find_key(x.attrib, keys)], e_to_dict(x, **kwargs)) for x in xml_element.findall(tag)])
+    d = OrderedDict()
+    for x in xml_element.findall(tag):
+        k = x.attrib[msa.utils.find_key(x.attrib, keys)]
+        if filter_fn is None or filter_fn(tag, k, x): d[k] = e_to_dict(x, **kwargs)
+    return d
+
+
+def iter_children_by_key(xml_path, tags, keys=['id', 'name'], filter_fn=None, **kwargs):
+    '''stream the children of the root element of an xml file (without loading the whole tree)
+    yields (tag, key, dict) for every child with a tag in tags, in document order
+    where attribute denoted by 'key' is used as key (same as children_by_key)
+    if filter_fn is given, only children for which filter_fn(tag, key, element) is True are converted
+    every child of the root is cleared and dropped once it's been consumed, so memory stays flat regardless of file size
+    '''
+    if type(tags) not in (list, tuple, set): tags = [tags]
+    for _, x in etree.iterparse(xml_path, events=('end',)):
+        parent = x.getparent()
+        if parent is None or parent.getparent() is not None: continue # only interested in children of root
+        if x.tag in tags:
+            k = x.attrib.get(msa.utils.find_key(x.attrib, keys))
+            if filter_fn is None or filter_fn(x.tag, k, x): yield x.tag, k, e_to_dict(x, **kwargs)
+        # free consumed element and any preceding siblings still hanging off root
+        x.clear()
+        while x.getprevious() is not None: del parent[0]
+
 
+def root_attrib(xml_path):
+    '''return attributes of the root element of an xml file, without parsing the rest of it'''
+    for _, x in etree.iterparse(xml_path, events=('start',)):
+        return dict(x.attrib)
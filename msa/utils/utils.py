@@ -18,21 +18,22 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import, division, print_function
-from builtins import range # pip install future
+try: range = xrange # python 2 (future's builtins is slow to import)
+except NameError: pass
 
 import time
 import datetime
-import socket
 import os
-import inspect
 import threading
 
 verbose=1
 
 def get_fn(stack=1):
+    import inspect
     return inspect.stack()[stack] # stack==1, to return caller's info 
 
 def get_fn_name(stack=1):
+    import inspect
     return inspect.stack()[stack][3] # stack==1, to return caller's info 
 
 def log_fn(fn, *args, **kwargs):
@@ -85,6 +86,7 @@ def find_key(haystack, needles):
         
         
 def hostname():
+    import socket
     return socket.gethostname()
 
 
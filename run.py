@@ -23,47 +23,80 @@ if __name__=='__main__':
     
     import numpy as np
     import sys
+    import os
     import argparse
     from pprint import pprint
 
     import msa.kdenlive
+    import msa.logger
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-k', '--kdenlive_prj_path', required=True, help='path to kdenlive project')
     parser.add_argument('-n', '--track_name', default='Video 1', help='name of track in kdenlive project to use')
-    parser.add_argument('-i', '--input_path', required=True, help='path to input numpy array (e.g. containing z-sequence) or video file')
+    parser.add_argument('-i', '--input_path', required=True, help='path to input numpy array (e.g. containing z-sequence) or video file. If a folder, each producer (clip) in the project is loaded from its own file in this folder when needed')
+    parser.add_argument('-e', '--source_ext', default='', help='[OPTIONAL] if input_path is a folder, replace extension of clips with this (e.g. .npy to conform z-sequences saved with the same names as the videos used in the edit)')
     parser.add_argument('-g', '--groundtruth_path', default='', help='[OPTIONAL] path to ground truth edited array or video file (for checking functionality')
     parser.add_argument('-o', '--output_path', default='out.npy', help='path to desired output numpy array containing conformed sequence')
-    parser.add_argument('-v', '--verbose', default=0, type=int, help='if 1, dumps entire edit to console (comparing to ground truth if available')
+    parser.add_argument('-v', '--verbose', default=0, type=int, help='if 1, prints errors of every clip when checking against ground truth (not just the ones which differ). if 2, also dumps entire edit to console (comparing to ground truth if available)')
+    parser.add_argument('-a', '--tolerance', default=0, type=float, help='maximum absolute error per value allowed when checking against ground truth (e.g. for lossy video)')
+    parser.add_argument('-f', '--stop_at_first_failure', default=0, type=int, help='if 1, stop checking against ground truth at the first chunk which differs')
+    parser.add_argument('-m', '--mmap', default=0, type=int, help='if 1, memory map input numpy arrays and write output straight to disk in chunks (for sequences too big for RAM)')
+    parser.add_argument('-s', '--stream', default=0, type=int, help='if 1, decode input video lazily (only the frames used by the track) and write output (npy or video, depending on extension) in chunks as it goes')
+    parser.add_argument('-c', '--chunk_size', default=64, type=int, help='number of frames to write at a time when --mmap or --stream is 1')
+    parser.add_argument('-p', '--prefetch', default=0, type=int, help='when --mmap or --stream is 1, read up to this many chunks ahead on background threads while writing (0 to read each chunk when needed)')
+    parser.add_argument('-P', '--prefetch_workers', default=1, type=int, help='number of threads reading ahead when --prefetch > 0 (video sources always use 1, as they decode sequentially)')
+    parser.add_argument('-j', '--copy_threads', default=1, type=int, help='number of threads to split big frame copies across (0 for number of cpus). Only helps for big frames e.g. HD or 4K video')
+    parser.add_argument('-u', '--incremental', default=0, type=int, help='if 1, only rewrite the frames of output_path (npy) which changed since the last conform (the previous edit is saved next to it)')
+    parser.add_argument('-C', '--cache', default=0, type=int, help='if 1, cache parsed project on disk (in $MSA_KDENLIVE_CACHE or ~/.cache/msa_kdenlive) so it loads instantly next time if unchanged')
+    parser.add_argument('-t', '--tracks', default=None, nargs='+', help='[OPTIONAL] conform these tracks (or "all") in parallel instead of --track_name. output_path is used as a template e.g. "out_{name}.npy"')
+    parser.add_argument('-T', '--tractor', default=0, type=int, help='if 1, conform all tracks of the main tractor composited into one (top most clip at each frame, blanks are transparent, dissolves are blended) instead of --track_name')
+    parser.add_argument('-b', '--blend', default='lerp', help='how to blend dissolves when using --tractor: lerp or slerp (video is always alpha blended)')
+    parser.add_argument('-x', '--profile', default=0, type=int, help='if 1, print a table of time, cpu, memory and bytes moved for each stage (project parsing, decoding, copying, writing etc.)')
+    parser.add_argument('-X', '--trace_path', default='', help='[OPTIONAL] path to save chrome trace json of each stage to (open in chrome://tracing or ui.perfetto.dev)')
+    parser.add_argument('-w', '--workers', default=0, type=int, help='number of worker processes when using --tracks (0 for number of cpus)')
     args = parser.parse_args()
     
     pprint(args.__dict__)
+    if args.profile or args.trace_path: msa.logger.enable_spans()
     
     # load project
     print('Loading Kdenlive project:', args.kdenlive_prj_path)
-    prj = msa.kdenlive.Project(args.kdenlive_prj_path)
+    with msa.logger.span('run.load_project'):
+        prj = msa.kdenlive.load_project(args.kdenlive_prj_path) if args.cache else msa.kdenlive.Project(args.kdenlive_prj_path)
     
     # get all tracks
     track_names = msa.kdenlive.get_track_names(prj.tracks)
     print('Found {} tracks, called {}'.format(len(track_names), track_names))
     
+    # conform several tracks in parallel
+    if args.tracks:
+        results = msa.kdenlive.conform_tracks(prj, args.input_path, args.output_path, track_names=None if args.tracks == ['all'] else args.tracks, 
+                                              num_workers=args.workers or None, chunk_size=args.chunk_size, source_ext=args.source_ext or None)
+        print('='*80)
+        msa.kdenlive.print_summary(results)
+        sys.exit(1 if any(r['error'] for r in results) else 0)
+    
     # find the track(s) with the right name. Note this returns a list
     try:
-        track = msa.kdenlive.find_tracks_by_name(prj.tracks, args.track_name)[0]
-        print('Track "{}" found with length {} frames'.format(args.track_name, track[msa.kdenlive.KEY_LENGTH]))
+        if args.tractor: track, transitions = prj.composite(), msa.kdenlive.get_transitions(prj)
+        else: track, transitions = prj.timeline.find_by_name(args.track_name)[0], []
     except:
-        print('Track "{}" not found'.format(args.track_name))
+        print('Track "{}" not found'.format('tractor' if args.tractor else args.track_name))
         sys.exit(1)
+    print('Track "{}" found with length {} frames'.format(msa.kdenlive.native_str(track.name), track.length))
         
         
     
-    def load(path):
+    def load(path, lazy=False):
         try:
             if path.endswith('.npy'): # Load numpy array
                 print('Loading numpy array', path)
-                return np.load(path)
+                return np.load(path, mmap_mode='r' if args.mmap or lazy else None)
             
             if path.endswith('.mp4') or path.endswith('.mov'): # Load video
+                if lazy:
+                    print('Opening video', path)
+                    return msa.kdenlive.VideoReader(path)
                 print('Loading video', path)
                 import skvideo.io # pip install sk-video.
                 return skvideo.io.vread(path)
@@ -75,17 +108,51 @@ if __name__=='__main__':
             
             
     # load input
-    src = load(args.input_path)
+    with msa.logger.span('run.load_input'):
+        if os.path.isdir(args.input_path):
+            print('Using sources in folder', args.input_path)
+            src = msa.kdenlive.SourceRegistry(prj.producers, root_dir=args.input_path, search_dirs=[prj.root_dir], ext=args.source_ext or None, mmap_mode='r' if args.mmap or args.stream else None)
+        else:
+            src = load(args.input_path, lazy=args.stream)
     
-    # load ground truth already edited sequence if it exists (for checking)
-    ref = load(args.groundtruth_path) if args.groundtruth_path else None
+    # open ground truth already edited sequence if it exists (for checking). memmapped or decoded lazily, it's compared in chunks
+    with msa.logger.span('run.load_groundtruth'):
+        ref = load(args.groundtruth_path, lazy=True) if args.groundtruth_path else None
           
         
     # conform (apply edit)
-    print('Conforming edit on track "{}" with {} frames onto {}'.format(track[msa.kdenlive.KEY_TRACK_NAME], track[msa.kdenlive.KEY_LENGTH], args.input_path))
-    edited = msa.kdenlive.conform_track_edit(track, src, empty_value=0)
+    copy_threads = args.copy_threads or None
+    print('Conforming edit on track "{}" with {} frames onto {}'.format(msa.kdenlive.native_str(track.name), track.length, args.input_path))
+    with msa.logger.span('run.conform'):
+        if args.incremental:
+            # only update frames which have changed since the last conform to output_path
+            if os.path.isdir(args.input_path): source_id = ';'.join(msa.kdenlive.file_id(p) for p in sorted(set(src.paths.values())) if os.path.exists(p))
+            else: source_id = msa.kdenlive.file_id(args.input_path)
+            stats = msa.kdenlive.conform_track_incremental(track, src, args.output_path, source_id=source_id, chunk_size=args.chunk_size, transitions=transitions, blend=args.blend)
+            print('Saved conformed sequence to {} ({} update, {} frames written)'.format(args.output_path, stats['mode'], stats['frames']))
+            edited = np.load(args.output_path, mmap_mode='r')
+        elif args.mmap or args.stream:
+            # lazy view of the edit, written straight to disk chunk by chunk
+            print('Saving conformed sequence to', args.output_path, 'in chunks of', args.chunk_size)
+            if isinstance(src, msa.kdenlive.VideoReader): src.plan([(i, o) for _, i, o in track.source_ranges()])
+            view = msa.kdenlive.EditView(track, src, empty_value=0, transitions=transitions, blend=args.blend, copy_threads=copy_threads)
+            if args.prefetch:
+                reader = msa.kdenlive.PrefetchReader(view, args.chunk_size, depth=args.prefetch, num_workers=args.prefetch_workers)
+                with msa.kdenlive.open_writer(args.output_path, view.shape, view.dtype, fps=getattr(src, 'fps', 25)) as writer:
+                    for chunk in reader: writer.write(chunk)
+                print('Read {} chunks ahead with {} threads, reading took {:.2f}s, waited {:.2f}s for chunks'.format(args.prefetch, reader.num_workers, reader.read_time, reader.wait_time))
+                edited = np.load(args.output_path, mmap_mode='r') if args.output_path.endswith('.npy') else None
+            else:
+                edited = msa.kdenlive.write_in_batches(args.output_path, view, args.chunk_size, fps=getattr(src, 'fps', 25))
+            if isinstance(src, msa.kdenlive.VideoReader):
+                print('Decoded {} of {} source frames with {} seeks'.format(src.num_decoded, len(src), src.num_seeks))
+                src.close()
+        elif transitions:
+            edited = msa.kdenlive.EditView(track, src, empty_value=0, transitions=transitions, blend=args.blend, copy_threads=copy_threads)[:]
+        else:
+            edited = msa.kdenlive.conform_track_edit(track, src, empty_value=0, copy_threads=copy_threads)
     
-    if args.verbose:
+    if args.verbose > 1 and edited is not None:
         for i,v in enumerate(edited): 
             print('-'*80)
             print('frame #{}'.format(i))
@@ -95,11 +162,26 @@ if __name__=='__main__':
     
     
     print('='*80)
-    print('Saving conformed sequence to', args.output_path)
-    np.save(args.output_path, edited)
+    if not (args.mmap or args.stream or args.incremental):
+        print('Saving conformed sequence to', args.output_path)
+        with msa.logger.span('run.save') as span:
+            np.save(args.output_path, edited)
+            span.add_bytes(edited.nbytes)
     
     
     if ref is not None:
-        print('Mean squared error between ground truth edit and python edit is', np.linalg.norm(ref - edited))
-        
-                
\ No newline at end of file
+        if edited is None: edited = load(args.output_path, lazy=True) # written as video
+        with msa.logger.span('run.compare'):
+            report = msa.kdenlive.verify_edit(edited, ref, track, chunk_size=args.chunk_size, tolerance=args.tolerance, stop_at_first_failure=args.stop_at_first_failure)
+        msa.kdenlive.print_verify_report(report, all_clips=args.verbose > 0)
+        print('Mean squared error between ground truth edit and python edit is', report['norm'])
+        if isinstance(ref, msa.kdenlive.VideoReader): ref.close()
+        if isinstance(edited, msa.kdenlive.VideoReader): edited.close()
+    
+    
+    if args.profile:
+        print('='*80)
+        msa.logger.print_span_summary()
+    if args.trace_path:
+        msa.logger.save_chrome_trace(args.trace_path)
+        print('Saved trace to', args.trace_path)
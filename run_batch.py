@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Copyright 2018, Memo Akten, www.memo.tv
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+if __name__=='__main__':
+    
+    import sys
+    import argparse
+    from pprint import pprint
+
+    import msa.kdenlive
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--manifest_path', required=True, help='path to json or csv manifest of jobs, each with project, track, input, output (see msa.kdenlive.load_manifest)')
+    parser.add_argument('-w', '--workers', default=0, type=int, help='number of worker processes (0 for number of cpus)')
+    parser.add_argument('-r', '--retries', default=1, type=int, help='number of times to retry a failed job before skipping it')
+    parser.add_argument('-c', '--chunk_size', default=64, type=int, help='number of frames to write at a time')
+    parser.add_argument('-C', '--cache', default=0, type=int, help='if 1, cache parsed projects on disk (in $MSA_KDENLIVE_CACHE or ~/.cache/msa_kdenlive) so unchanged projects load instantly next time')
+    parser.add_argument('-p', '--report_path', default='', help='[OPTIONAL] path to save json report of per job timings')
+    args = parser.parse_args()
+    
+    pprint(args.__dict__)
+    
+    jobs = msa.kdenlive.load_manifest(args.manifest_path)
+    print('Loaded {} jobs from {}'.format(len(jobs), args.manifest_path))
+    
+    results = msa.kdenlive.conform_manifest(jobs, num_workers=args.workers or None, retries=args.retries, chunk_size=args.chunk_size,
+                                              cache_dir=msa.kdenlive.DEFAULT_CACHE_DIR if args.cache else None)
+    
+    print('='*80)
+    msa.kdenlive.print_summary(results)
+    
+    if args.report_path:
+        print('Saving report to', args.report_path)
+        msa.kdenlive.save_report(results, args.report_path)
+        
+    sys.exit(1 if any(r['error'] for r in results) else 0)
+    
@@ -0,0 +1,4 @@
+python run_batch.py \
+    --manifest_path "./testdata/test_manifest.json" \
+    --workers 2 \
+    --report_path "batch_report.json"
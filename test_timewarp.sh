@@ -0,0 +1,7 @@
+python run.py \
+    --kdenlive_prj_path "./testdata/test_timewarp.kdenlive" \
+    --track_name "Video 1" \
+    --input_path "./testdata/z_orig.npy" \
+    --groundtruth_path "./testdata/z_edited_timewarp.npy" \
+    --output_path "z_out_timewarp.npy" \
+    --verbose 0
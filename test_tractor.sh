@@ -0,0 +1,7 @@
+python run.py \
+    --kdenlive_prj_path "./testdata/test_transitions.kdenlive" \
+    --tractor 1 \
+    --input_path "./testdata/z_orig.npy" \
+    --groundtruth_path "./testdata/z_edited_transitions.npy" \
+    --output_path "z_out_tractor.npy" \
+    --verbose 0